@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""Offline benchmark of the contrail-controller charm hooks.
+
+Real hook entry points of the charm are executed with fake hook tools,
+docker and contrail-status on PATH. The fake tools are backed by a synthetic
+model of N controllers, M analytics nodes and K agents, so neither network
+nor Juju controller is needed. Latency of hooks, number of started
+processes and relation writes are reported per scenario.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import hooktool
+import model
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+
+
+class HookFailed(Exception):
+    pass
+
+
+class Bench(object):
+    """Environment of one unit of the charm with its own copy of charm dir."""
+
+    def __init__(self, workdir, python, charm_dir, data):
+        self.dir = workdir
+        self.python = python
+        self.charm = os.path.join(workdir, "charm")
+        shutil.copytree(charm_dir, self.charm, symlinks=True)
+        self.bin = os.path.join(workdir, "bin")
+        os.mkdir(self.bin)
+        os.symlink(python, os.path.join(self.bin, "python"))
+        tool = os.path.join(HERE, "hooktool.py")
+        for name in list(hooktool.TOOLS) + hooktool.NOOP_TOOLS:
+            os.symlink(tool, os.path.join(self.bin, name))
+        self.model_path = os.path.join(workdir, "model.json")
+        self.calls_path = os.path.join(workdir, "calls.log")
+        self.forks_path = os.path.join(workdir, "forks.json")
+        # stands for / of the host for files that hooks write into /etc
+        self.root = os.path.join(workdir, "root")
+        etc_dir = os.path.join(self.root, "etc")
+        os.makedirs(os.path.join(etc_dir, "contrailctl", "ssl"))
+        os.makedirs(os.path.join(etc_dir, "systemd", "system"))
+        shutil.copy("/etc/hosts", os.path.join(etc_dir, "hosts"))
+        self.unit = data["unit"]
+        self.save(data)
+        self.results = list()
+
+    def load(self):
+        with open(self.model_path) as f:
+            return json.load(f)
+
+    def save(self, data):
+        with open(self.model_path, "w") as f:
+            json.dump(data, f)
+
+    def seed_config(self, values):
+        """Stores values as they were persisted by previous hooks."""
+        path = os.path.join(self.charm, ".juju-persistent-config")
+        with open(path, "w") as f:
+            json.dump(values, f)
+
+    def _env(self, hook, rid, remote_unit):
+        env = dict(os.environ)
+        for key in ("JUJU_RELATION", "JUJU_RELATION_ID", "JUJU_REMOTE_UNIT"):
+            env.pop(key, None)
+        env.update({
+            "PATH": self.bin + os.pathsep + env.get("PATH", ""),
+            "CHARM_DIR": self.charm,
+            "UNIT_STATE_DB": os.path.join(self.dir, "unit-state.db"),
+            "JUJU_UNIT_NAME": self.unit,
+            "JUJU_HOOK_NAME": hook,
+            "JUJU_VERSION": "2.4.0",
+            "BENCH_BIN": self.bin,
+            "BENCH_MODEL": self.model_path,
+            "BENCH_CALLS": self.calls_path,
+            "BENCH_FORKS": self.forks_path,
+            "BENCH_ROOT": self.root,
+        })
+        if rid:
+            env["JUJU_RELATION"] = rid.split(":")[0]
+            env["JUJU_RELATION_ID"] = rid
+        if remote_unit:
+            env["JUJU_REMOTE_UNIT"] = remote_unit
+        return env
+
+    def run(self, hook, rid=None, remote_unit=None, measure=True):
+        open(self.calls_path, "w").close()
+        cmd = [self.python, os.path.join(HERE, "launcher.py"),
+               os.path.join(self.charm, "hooks", hook)]
+        started = time.time()
+        proc = subprocess.Popen(cmd, env=self._env(hook, rid, remote_unit),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        elapsed = time.time() - started
+        if proc.returncode != 0:
+            raise HookFailed("Hook {} failed:\n{}".format(
+                hook, output.decode("UTF-8", "replace")[-3000:]))
+
+        tools = Counter()
+        writes = keys = 0
+        with open(self.calls_path) as f:
+            for line in f:
+                call = json.loads(line)
+                tools[call["tool"]] += 1
+                if call["tool"] == "relation-set":
+                    writes += 1
+                    keys += call["keys"]
+        with open(self.forks_path) as f:
+            forks = json.load(f)["forks"]
+        result = {
+            "hook": hook,
+            "time": elapsed,
+            "forks": forks,
+            "tools": dict(tools),
+            "relation-writes": writes,
+            "relation-keys": keys,
+        }
+        if measure:
+            self.results.append(result)
+        return result
+
+
+def _agents_info(count):
+    return json.dumps(dict((model.address(3, i), "False")
+                           for i in range(count)))
+
+
+def scenario_update_status(bench, args):
+    """Idle leader with whole model related."""
+    bench.seed_config({"agents-info": _agents_info(args.agents)})
+    bench.run("config-changed", measure=False)
+    for _ in range(args.repeat):
+        bench.run("update-status")
+
+
+def scenario_leader_reelection(bench, args):
+    """Unit becomes the leader and gets the next change from openstack."""
+    data = bench.load()
+    data["leader"] = False
+    bench.save(data)
+    bench.seed_config({"agents-info": _agents_info(args.agents)})
+    bench.run("config-changed", measure=False)
+
+    data = bench.load()
+    data["leader"] = True
+    bench.save(data)
+    bench.run("leader-elected")
+    bench.run("contrail-controller-relation-changed",
+              model.OPENSTACK_RID, "contrail-openstack/0")
+
+
+def scenario_agent_scale_out(bench, args):
+    """Agents are added one by one up to the requested number."""
+    data = bench.load()
+    data["relations"][model.AGENTS_RID]["units"] = dict()
+    bench.save(data)
+    bench.run("config-changed", measure=False)
+
+    for i in range(args.agents):
+        unit = "contrail-agent/{}".format(i)
+        data = bench.load()
+        data["relations"][model.AGENTS_RID]["units"][unit] = (
+            model.agent_settings(i))
+        bench.save(data)
+        bench.run("contrail-controller-relation-joined",
+                  model.AGENTS_RID, unit)
+        bench.run("contrail-controller-relation-changed",
+                  model.AGENTS_RID, unit)
+
+
+def scenario_auth_change(bench, args):
+    """Keystone credentials are changed and published to all relations."""
+    bench.seed_config({"agents-info": _agents_info(args.agents)})
+    bench.run("config-changed", measure=False)
+
+    for i in range(args.repeat):
+        data = bench.load()
+        auth_unit = data["relations"][model.AUTH_RID]["units"][
+            "contrail-keystone-auth/0"]
+        auth_unit["auth-info"] = model.auth_info("password-{}".format(i))
+        bench.save(data)
+        bench.run("contrail-auth-relation-changed",
+                  model.AUTH_RID, "contrail-keystone-auth/0")
+
+
+SCENARIOS = [
+    ("update-status", scenario_update_status),
+    ("leader-reelection", scenario_leader_reelection),
+    ("agent-scale-out", scenario_agent_scale_out),
+    ("auth-change", scenario_auth_change),
+]
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+def summarize(name, results):
+    times = [r["time"] for r in results]
+    tools = Counter()
+    for r in results:
+        tools.update(r["tools"])
+    count = len(results)
+    summary = {
+        "scenario": name,
+        "hooks": count,
+        "total": sum(times),
+        "mean": sum(times) / count,
+        "p50": _percentile(times, 50),
+        "p95": _percentile(times, 95),
+        "max": max(times),
+        "forks": sum(r["forks"] for r in results),
+        "relation-writes": sum(r["relation-writes"] for r in results),
+        "relation-keys": sum(r["relation-keys"] for r in results),
+        "tools": dict(tools),
+    }
+    if count >= 20:
+        # growth of latency shows O(N) work per hook
+        tenth = count // 10
+        summary["first-10%-mean"] = sum(times[:tenth]) / tenth
+        summary["last-10%-mean"] = sum(times[-tenth:]) / tenth
+    return summary
+
+
+def print_report(summaries):
+    header = ("{:<20} {:>6} {:>9} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9}"
+              .format("scenario", "hooks", "total,s", "mean,ms", "p95,ms",
+                      "max,ms", "forks", "rel-sets", "rel-keys"))
+    print(header)
+    print("-" * len(header))
+    for s in summaries:
+        print("{:<20} {:>6} {:>9.2f} {:>8.1f} {:>8.1f} {:>8.1f} {:>9} {:>9} "
+              "{:>9}".format(
+                  s["scenario"], s["hooks"], s["total"], s["mean"] * 1000,
+                  s["p95"] * 1000, s["max"] * 1000, s["forks"],
+                  s["relation-writes"], s["relation-keys"]))
+    for s in summaries:
+        print()
+        print("{}: hook tool calls: {}".format(s["scenario"], ", ".join(
+            "{}={}".format(tool, count)
+            for tool, count in sorted(s["tools"].items()))))
+        if "last-10%-mean" in s:
+            print("{}: mean latency of the first 10% of hooks {:.1f} ms, "
+                  "of the last 10% {:.1f} ms".format(
+                      s["scenario"], s["first-10%-mean"] * 1000,
+                      s["last-10%-mean"] * 1000))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("scenarios", nargs="*",
+                        help="Scenarios to run (default: all). Available: "
+                        + ", ".join(name for name, _ in SCENARIOS))
+    parser.add_argument("--controllers", type=int, default=3)
+    parser.add_argument("--analytics", type=int, default=3)
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of measured hooks in steady scenarios")
+    parser.add_argument("--python", default=sys.executable,
+                        help="Interpreter with dependencies of the charm")
+    parser.add_argument("--charm",
+                        default=os.path.join(REPO, "contrail-controller"))
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep working directories of scenarios")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    names = args.scenarios or [name for name, _ in SCENARIOS]
+    unknown = set(names) - set(name for name, _ in SCENARIOS)
+    if unknown:
+        sys.exit("Unknown scenarios: " + ", ".join(sorted(unknown)))
+
+    summaries = list()
+    raw = dict()
+    for name, func in SCENARIOS:
+        if name not in names:
+            continue
+        workdir = tempfile.mkdtemp(prefix="bench-" + name + "-")
+        try:
+            data = model.controller_model(
+                args.charm, args.controllers, args.analytics, args.agents)
+            bench = Bench(workdir, args.python, args.charm, data)
+            print("Running {} ...".format(name), file=sys.stderr)
+            func(bench, args)
+        except HookFailed as e:
+            sys.exit("Scenario {} failed. {}".format(name, e))
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        summaries.append(summarize(name, bench.results))
+        raw[name] = bench.results
+
+    print_report(summaries)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summaries, "hooks": raw}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""Fake Juju hook tools, docker and contrail-status for the benchmark.
+
+All tools are symlinks to this script. The tool is chosen by the name it
+was called with. State of the synthetic model is kept in the JSON file
+pointed by BENCH_MODEL and every call is appended to BENCH_CALLS.
+"""
+
+import json
+import os
+import sys
+
+import yaml
+
+
+def _load():
+    with open(os.environ["BENCH_MODEL"]) as f:
+        return json.load(f)
+
+
+def _save(model):
+    path = os.environ["BENCH_MODEL"]
+    with open(path + ".tmp", "w") as f:
+        json.dump(model, f)
+    os.rename(path + ".tmp", path)
+
+
+def _log(tool, args, keys=0):
+    with open(os.environ["BENCH_CALLS"], "a") as f:
+        f.write(json.dumps({"tool": tool, "args": args, "keys": keys}))
+        f.write("\n")
+
+
+def _out(value):
+    sys.stdout.write(json.dumps(value))
+    sys.stdout.write("\n")
+
+
+def _pop_option(args, name):
+    if name not in args:
+        return None
+    index = args.index(name)
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
+
+def _positional(args):
+    return [arg for arg in args if not arg.startswith("--")]
+
+
+def _parse_settings(args):
+    settings = dict()
+    for arg in args:
+        key, value = arg.split("=", 1)
+        settings[key] = value
+    return settings
+
+
+def _update(target, settings):
+    for key, value in settings.items():
+        if value in (None, ""):
+            target.pop(key, None)
+        else:
+            target[key] = "{}".format(value)
+
+
+def config_get(model, args):
+    args = _positional(args)
+    config = model["config"]
+    _out(config.get(args[0]) if args else config)
+
+
+def relation_ids(model, args):
+    name = _positional(args)[0]
+    _out(sorted(rid for rid, rel in model["relations"].items()
+                if rel["name"] == name))
+
+
+def relation_list(model, args):
+    rid = _pop_option(args, "-r") or os.environ.get("JUJU_RELATION_ID")
+    relation = model["relations"].get(rid)
+    _out(sorted(relation["units"]) if relation else [])
+
+
+def relation_get(model, args):
+    rid = _pop_option(args, "-r") or os.environ.get("JUJU_RELATION_ID")
+    args = _positional(args)
+    key = args[0] if args else "-"
+    unit = args[1] if len(args) > 1 else os.environ.get("JUJU_REMOTE_UNIT")
+    relation = model["relations"].get(rid)
+    if relation is None:
+        sys.stderr.write("ERROR invalid relation id {}\n".format(rid))
+        sys.exit(2)
+    if unit == model["unit"]:
+        settings = relation["local"]
+    else:
+        settings = relation["units"].get(unit, dict())
+    _out(settings if key == "-" else settings.get(key))
+
+
+def relation_set(model, args):
+    rid = _pop_option(args, "-r") or os.environ.get("JUJU_RELATION_ID")
+    path = _pop_option(args, "--file")
+    if path:
+        with open(path) as f:
+            settings = yaml.safe_load(f) or dict()
+    else:
+        settings = _parse_settings(args)
+    _update(model["relations"][rid]["local"], settings)
+    _save(model)
+    return len(settings)
+
+
+def leader_get(model, args):
+    args = _positional(args)
+    key = args[0] if args else "-"
+    settings = model["leader-settings"]
+    _out(settings if key == "-" else settings.get(key))
+
+
+def leader_set(model, args):
+    if not model["leader"]:
+        sys.stderr.write("ERROR cannot write leadership settings: "
+                         "not the leader\n")
+        sys.exit(1)
+    settings = _parse_settings(args)
+    _update(model["leader-settings"], settings)
+    _save(model)
+    return len(settings)
+
+
+def is_leader(model, args):
+    _out(model["leader"])
+
+
+def unit_get(model, args):
+    _out(model["address"])
+
+
+def status_set(model, args):
+    model["status"] = {"status": args[0], "message": args[1]}
+    _save(model)
+
+
+def status_get(model, args):
+    status = dict(model["status"])
+    status["status-data"] = dict()
+    _out(status)
+
+
+def docker(model, args):
+    containers = model["docker"]["containers"]
+    command = args[0]
+    if command == "inspect":
+        kind = _pop_option(args, "--type")
+        fmt = _pop_option(args, "-f")
+        name = args[-1]
+        if kind == "image":
+            image = model["docker"]["images"].get(name)
+            if not image:
+                sys.exit(1)
+            _out([image])
+            return
+        container = containers.get(name)
+        if not container:
+            sys.exit(1)
+        if fmt:
+            sys.stdout.write("{} {} {}\n".format(
+                "true" if container["running"] else "false",
+                "running" if container["running"] else "exited",
+                container["image"]))
+        else:
+            _out([container])
+    elif command == "exec":
+        name, cmd = args[1], args[2:]
+        if not containers.get(name, {}).get("running"):
+            sys.exit(1)
+        if cmd and cmd[0] == "contrail-status":
+            sys.stdout.write(model["contrail-status"])
+    elif command == "run":
+        name = [arg.split("=", 1)[1] for arg in args
+                if arg.startswith("--name=")][0]
+        containers[name] = {"running": True, "image": args[-1]}
+        _save(model)
+
+
+def contrail_status(model, args):
+    sys.stdout.write(model["contrail-status"])
+
+
+TOOLS = {
+    "config-get": config_get,
+    "relation-ids": relation_ids,
+    "relation-list": relation_list,
+    "relation-get": relation_get,
+    "relation-set": relation_set,
+    "leader-get": leader_get,
+    "leader-set": leader_set,
+    "is-leader": is_leader,
+    "unit-get": unit_get,
+    "status-set": status_set,
+    "status-get": status_get,
+    "docker": docker,
+    "contrail-status": contrail_status,
+}
+
+# tools that are accepted and do nothing
+NOOP_TOOLS = [
+    "juju-log",
+    "application-version-set",
+    "open-port",
+    "close-port",
+    "action-get",
+    "action-set",
+    "action-fail",
+]
+
+
+def main():
+    tool = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+    func = TOOLS.get(tool)
+    keys = 0
+    try:
+        if "--help" in args:
+            sys.stdout.write("usage: {} [options] --file <path>\n"
+                             .format(tool))
+        elif func is not None:
+            keys = func(_load(), list(args))
+    finally:
+        _log(tool, args, keys or 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Runs a real hook of the charm inside the benchmark environment.
+
+Usage: launcher.py <charm_dir>/hooks/<hook-name>
+
+The hook is executed as Juju does it, except that docker client of the
+charm is pointed to the fake docker, files that hooks write into /etc are
+placed under the benchmark root and every started subprocess is counted.
+"""
+
+import json
+import os
+import runpy
+import subprocess
+import sys
+
+
+_forks = [0]
+_Popen = subprocess.Popen
+
+
+class _CountingPopen(_Popen):
+
+    def __init__(self, *args, **kwargs):
+        _forks[0] += 1
+        super(_CountingPopen, self).__init__(*args, **kwargs)
+
+
+def _report():
+    with open(os.environ["BENCH_FORKS"], "w") as f:
+        json.dump({"forks": _forks[0]}, f)
+
+
+def main():
+    hook = os.path.abspath(sys.argv[1])
+    hooks_dir = os.path.dirname(hook)
+    os.chdir(os.path.dirname(hooks_dir))
+    sys.path.insert(0, hooks_dir)
+    subprocess.Popen = _CountingPopen
+
+    bin_dir = os.environ["BENCH_BIN"]
+    try:
+        import docker_utils
+    except ImportError:
+        docker_utils = None
+    if docker_utils is not None:
+        docker_utils.DOCKER_CLI = os.path.join(bin_dir, "docker")
+        # there is no docker daemon, so API client falls back to the CLI
+        docker_utils.DOCKER_SOCKET = os.path.join(bin_dir, "docker.sock")
+
+    # hooks must not touch configuration and hosts file of the host
+    etc_dir = os.path.join(os.environ["BENCH_ROOT"], "etc")
+    try:
+        import common_utils
+    except ImportError:
+        common_utils = None
+    if common_utils is not None:
+        config_dir = os.path.join(etc_dir, "contrailctl")
+        common_utils.CONFIG_DIR = config_dir
+        common_utils.HOSTS_FILE = os.path.join(etc_dir, "hosts")
+        for name in ("SERVER_CERT", "SERVER_KEY", "CA_CERT"):
+            path = getattr(common_utils, name)
+            setattr(common_utils, name, os.path.join(
+                config_dir, os.path.relpath(path, "/etc/contrailctl")))
+    try:
+        import reconciler
+    except ImportError:
+        reconciler = None
+    if reconciler is not None:
+        reconciler.SYSTEMD_DIR = os.path.join(etc_dir, "systemd", "system")
+
+    sys.argv = [hook]
+    try:
+        runpy.run_path(hook, run_name="__main__")
+    finally:
+        _report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Synthetic Juju model around the leader of contrail-controller."""
+
+import json
+
+import yaml
+
+CONTROLLER_UNIT = "contrail-controller/0"
+CONTROLLER_IMAGE = "sha256:" + "c" * 64
+CONTROLLER_SERVICES = ["contrail-control", "contrail-api", "contrail-webui"]
+
+CLUSTER_RID = "controller-cluster:1"
+ANALYTICS_RID = "contrail-analytics:2"
+ANALYTICSDB_RID = "contrail-analyticsdb:3"
+OPENSTACK_RID = "contrail-controller:4"
+AGENTS_RID = "contrail-controller:5"
+AUTH_RID = "contrail-auth:6"
+
+
+def address(net, index):
+    return "10.{}.{}.{}".format(net, index // 250, index % 250 + 1)
+
+
+def auth_info(password="password"):
+    return json.dumps({
+        "keystone_protocol": "http",
+        "keystone_ip": "10.99.0.1",
+        "keystone_public_port": "5000",
+        "keystone_admin_user": "admin",
+        "keystone_admin_password": password,
+        "keystone_admin_tenant": "admin",
+        "keystone_region": "RegionOne",
+        "keystone_api_version": "2",
+        "keystone_api_suffix": "v2.0",
+        "keystone_api_tokens": "v2.0/tokens",
+        "keystone_ssl_ca": None,
+    })
+
+
+def charm_config(charm_dir):
+    """Returns charm's config with defaults like 'config-get --all' does."""
+    with open(charm_dir + "/config.yaml") as f:
+        options = yaml.safe_load(f)["options"]
+    return dict((name, option["default"]) for name, option in options.items()
+                if option.get("default") is not None)
+
+
+def _relation(name, units):
+    return {"name": name, "units": units, "local": dict()}
+
+
+def agent_settings(index):
+    return {"private-address": address(3, index), "dpdk": "False",
+            "unit-type": "agent"}
+
+
+def controller_model(charm_dir, controllers, analytics, agents, leader=True):
+    """Builds the model of the controller unit with its relations.
+
+    The unit itself uses loopback as control network, so it doesn't depend
+    on network configuration of the host.
+    """
+    config = charm_config(charm_dir)
+    config.update({
+        "control-network": "lo",
+        "image-name": "contrail-controller",
+        "image-tag": "4.1",
+    })
+    own_ip = "127.0.0.1"
+    peers = dict(("contrail-controller/{}".format(i),
+                  {"unit-address": address(0, i)})
+                 for i in range(1, controllers))
+    controller_ips = dict((unit, data["unit-address"])
+                          for unit, data in peers.items())
+    controller_ips[CONTROLLER_UNIT] = own_ip
+    relations = {
+        CLUSTER_RID: _relation("controller-cluster", peers),
+        ANALYTICS_RID: _relation("contrail-analytics", dict(
+            ("contrail-analytics/{}".format(i),
+             {"private-address": address(1, i), "unit-type": "analytics"})
+            for i in range(analytics))),
+        ANALYTICSDB_RID: _relation("contrail-analyticsdb", dict(
+            ("contrail-analyticsdb/{}".format(i),
+             {"private-address": address(2, i)})
+            for i in range(analytics))),
+        OPENSTACK_RID: _relation("contrail-controller", {
+            "contrail-openstack/0": {
+                "private-address": address(4, 0),
+                "unit-type": "openstack",
+                "orchestrator-info": json.dumps(
+                    {"cloud_orchestrator": "openstack"}),
+            }}),
+        AGENTS_RID: _relation("contrail-controller", dict(
+            ("contrail-agent/{}".format(i), agent_settings(i))
+            for i in range(agents))),
+        AUTH_RID: _relation("contrail-auth", {
+            "contrail-keystone-auth/0": {"auth-info": auth_info()}}),
+    }
+    status = "".join("{}:{} active\n".format(srv, " " * 10)
+                     for srv in CONTROLLER_SERVICES)
+    return {
+        "unit": CONTROLLER_UNIT,
+        "address": own_ip,
+        "leader": leader,
+        "config": config,
+        "leader-settings": {
+            "db_user": "controller",
+            "db_password": "password",
+            "rabbitmq_password_int": "password",
+            "controller_ip_list": json.dumps(
+                [own_ip] + [address(0, i) for i in range(1, controllers)]),
+            "controller_ips": json.dumps(controller_ips),
+        },
+        "relations": relations,
+        "status": {"status": "unknown", "message": ""},
+        "docker": {
+            "containers": {
+                "contrail-controller": {
+                    "running": True, "image": CONTROLLER_IMAGE},
+            },
+            "images": {
+                "contrail-controller:4.1": {
+                    "Id": CONTROLLER_IMAGE,
+                    "RepoTags": ["contrail-controller:4.1"],
+                    "Config": {"Labels": {"version": "4.1.0.0-8"}},
+                },
+            },
+        },
+        "contrail-status": "== Contrail Control ==\n" + status,
+    }
@@ -12,8 +12,6 @@ from charmhelpers.core.hookenv import (
     log,
     ERROR,
     action_fail,
-    relation_get,
-    relation_set,
     relation_ids,
     related_units,
     status_set,
@@ -42,6 +40,8 @@ from subprocess import (
     check_call,
 )
 from contrail_agent_utils import (
+    apply_perf_profile,
+    check_vrouter_params,
     configure_crashes,
     configure_vrouter_interface,
     drop_caches,
@@ -52,10 +52,16 @@ from contrail_agent_utils import (
     set_dpdk_options,
     configure_hugepages,
     get_hugepages,
+    place_hugepages,
     fix_libvirt,
     tls_changed,
     get_control_network_ip,
+    write_vrouter_module_conf,
+    VROUTER_PARAMS,
 )
+from hook_profiler import hook_profiling
+import reconciler
+from relation_utils import relation_get, relation_set
 
 PACKAGES = ["dkms", "contrail-vrouter-agent", "contrail-utils",
             "contrail-vrouter-common", "contrail-setup"]
@@ -121,6 +127,7 @@ def install():
 
 
 def install_dkms():
+    write_vrouter_module_conf()
     try:
         log("Loading kernel module vrouter")
         modprobe("vrouter")
@@ -144,6 +151,7 @@ def install_dpdk():
     if pages:
         hugepage_support("root", group="root", nr_hugepages=pages,
                          mnt_point="/hugepages")
+        place_hugepages(pages)
         service_restart("libvirt-bin")
 
     configure_vrouter_interface()
@@ -195,12 +203,24 @@ def config_changed():
                             .format(key))
 
     if config["dpdk"]:
+        # automatic sizes depend on hugepages of the NIC's node
+        configure_hugepages()
         if (config.changed("dpdk-main-mempool-size") or config.changed("dpdk-pmd-txd-size")
-                or config.changed("dpdk-pmd-rxd-size") or config.changed("dpdk-coremask")):
+                or config.changed("dpdk-pmd-rxd-size") or config.changed("dpdk-coremask")
+                or config.changed("dpdk-core-count")
+                or config.changed("dpdk-hugepages")
+                or any(config.changed(opt) for _, opt in VROUTER_PARAMS)):
             set_dpdk_options()
-        configure_hugepages()
+    else:
+        write_vrouter_module_conf()
+        if (config.changed("kernel-perf-profile")
+                or config.changed("kernel-nic-offloads")
+                or config.changed("kernel-nic-ring-size")):
+            apply_perf_profile()
 
     write_configs()
+    reconciler.update_service()
+    check_vrouter_params()
 
 
 @hooks.hook("vrouter-plugin-relation-changed")
@@ -313,9 +333,15 @@ def update_status():
     update_unit_status()
 
 
+@hooks.hook("stop")
+def stop():
+    reconciler.remove_service()
+
+
 def main():
     try:
-        hooks.execute(sys.argv)
+        with hook_profiling():
+            hooks.execute(sys.argv)
     except UnregisteredHookError as e:
         log("Unknown hook {} - skipping.".format(e))
 
@@ -16,19 +16,20 @@ import netifaces
 
 from charmhelpers.core import sysctl
 from charmhelpers.core.hookenv import (
+    action_fail,
+    action_set,
     config,
     log,
     related_units,
-    relation_get,
     relation_ids,
     status_set,
+    ERROR,
     WARNING,
     unit_get,
 )
 
 from charmhelpers.core.host import (
     file_hash,
-    restart_on_change,
     write_file,
     service_restart,
     init_is_systemd,
@@ -37,7 +38,17 @@ from charmhelpers.core.host import (
     lsb_release,
 )
 
-from charmhelpers.core.templating import render
+import contrail_api_utils
+import dpdk_utils
+from introspect_utils import probe_service
+import reconciler
+from relation_utils import relation_get
+from restart_utils import (
+    restart_on_change,
+    restart_service,
+    schedule_restart,
+)
+from templating_utils import render
 
 apt_pkg.init()
 config = config()
@@ -46,6 +57,28 @@ config = config()
 # as it's hardcoded in several scripts/configs
 VROUTER_INTERFACE = "vhost0"
 
+# seconds to keep API server at the end of list after its failure
+API_FAILURE_MEMORY = 600
+
+SERVER_CERT = "/etc/contrail/ssl/certs/server.pem"
+SERVER_KEY = "/etc/contrail/ssl/private/server-privkey.pem"
+CA_CERT = "/etc/contrail/ssl/certs/ca-cert.pem"
+
+PERF_PROFILE_SCRIPT = "/etc/contrail/vrouter-perf.sh"
+VROUTER_INTERFACES_CFG = "/etc/network/interfaces.d/vrouter.cfg"
+# sets hugepages per NUMA node at boot
+HUGEPAGES_SERVICE = "contrail-hugepages"
+
+VROUTER_MODULE_CONF = "/etc/modprobe.d/vrouter.conf"
+# parameters of vrouter module (and DPDK vRouter) and their options
+VROUTER_PARAMS = (
+    ("vr_flow_entries", "vrouter-flow-entries"),
+    ("vr_oflow_entries", "vrouter-oflow-entries"),
+    ("vr_bridge_entries", "vrouter-bridge-entries"),
+    ("vr_mpls_labels", "vrouter-mpls-labels"),
+)
+FLOW_ENTRY_SIZE = 128
+
 
 def configure_crashes():
     mkdir("/var/crashes", perms=0o755, force=True)
@@ -53,7 +86,7 @@ def configure_crashes():
     sysctl.create(yaml.dump(options), "/etc/sysctl.d/10-core-pattern.conf")
 
 
-def retry(f=None, timeout=10, delay=2):
+def retry(f=None, timeout=10, delay=2, backoff=1, max_delay=None):
     """Retry decorator.
 
     Provides a decorator that can be used to retry a function if it raises
@@ -61,6 +94,8 @@ def retry(f=None, timeout=10, delay=2):
 
     :param timeout: timeout in seconds (default 10)
     :param delay: retry delay in seconds (default 2)
+    :param backoff: multiplier of delay after each retry (default 1)
+    :param max_delay: upper limit of growing delay (default no limit)
 
     Examples::
 
@@ -75,12 +110,14 @@ def retry(f=None, timeout=10, delay=2):
             # fetch url
     """
     if not f:
-        return functools.partial(retry, timeout=timeout, delay=delay)
+        return functools.partial(retry, timeout=timeout, delay=delay,
+                                 backoff=backoff, max_delay=max_delay)
 
     @functools.wraps(f)
     def func(*args, **kwargs):
         start = time()
         error = None
+        current_delay = delay
         while True:
             try:
                 return f(*args, **kwargs)
@@ -90,10 +127,39 @@ def retry(f=None, timeout=10, delay=2):
             if elapsed >= timeout:
                 raise error
             remaining = timeout - elapsed
-            sleep(delay if delay <= remaining else remaining)
+            sleep(min(current_delay, remaining))
+            current_delay *= backoff
+            if max_delay is not None:
+                current_delay = min(current_delay, max_delay)
     return func
 
 
+def wait_until(predicate, timeout=30, delay=0.5, backoff=2, max_delay=5):
+    """Waits until predicate returns true value.
+
+    Predicate is polled with exponentially growing delay between calls,
+    so the caller goes on as soon as the condition is met.
+
+    :param timeout: deadline in seconds (default 30)
+    :param delay: first delay between calls in seconds (default 0.5)
+    :param backoff: multiplier of delay after each call (default 2)
+    :param max_delay: upper limit of growing delay (default 5)
+    :returns: the last value returned by predicate, so it is false if
+        deadline has been reached
+    """
+    deadline = time() + timeout
+    while True:
+        result = predicate()
+        if result:
+            return result
+        remaining = deadline - time()
+        if remaining <= 0:
+            log("Condition was not met in {} seconds".format(timeout))
+            return result
+        sleep(min(delay, remaining))
+        delay = min(delay * backoff, max_delay)
+
+
 def _get_default_gateway_iface():
     if hasattr(netifaces, "gateways"):
         return netifaces.gateways()["default"][netifaces.AF_INET][1]
@@ -155,11 +221,19 @@ def configure_vrouter_interface():
         config["dpdk-pci"] = pci_address
         addr = netifaces.ifaddresses(iface)[netifaces.AF_PACKET][0]
         config["dpdk-mac"] = addr["addr"]
+        # queues aren't visible after the NIC is bound to DPDK driver
+        config["dpdk-nic-queues"] = dpdk_utils.nic_queues(iface)
 
     if config.get("vhost-mtu") and config["vhost-mtu"].isdigit():
         args.append("-m")
         args.append(config["vhost-mtu"])
 
+    if not config["dpdk"]:
+        # profile is applied on every start of vhost0
+        write_perf_profile()
+        args.append("-p")
+        args.append(PERF_PROFILE_SCRIPT)
+
     args.append(iface)
     check_call(args, cwd="scripts")
 
@@ -173,6 +247,132 @@ def configure_vrouter_interface():
     write_configs()
 
 
+def write_perf_profile():
+    """Renders the script that tunes physical interface of kernel vRouter.
+
+    With 'kernel-perf-profile' it sets RPS/XPS masks of the queues, IRQ
+    affinity over the cores local to the NIC, offloads and ring sizes.
+    Physical interface is known only when vhost0 is configured.
+    """
+    iface = config.get("vhost-physical")
+    if not iface:
+        return False
+    cpus = dpdk_utils.node_cpus(dpdk_utils.iface_numa_node(iface))
+    ctx = {
+        "enabled": config.get("kernel-perf-profile"),
+        "interface": iface,
+        "rps_mask": dpdk_utils.cpu_mask(cpus),
+        "core_masks": " ".join(dpdk_utils.cpu_mask([cpu]) for cpu in cpus),
+        "offloads": config.get("kernel-nic-offloads"),
+        "ring_size": config.get("kernel-nic-ring-size"),
+    }
+    render("vrouter-perf.sh", PERF_PROFILE_SCRIPT, ctx, perms=0o755)
+    return True
+
+
+def _add_perf_profile_hook():
+    # vhost0 of units deployed before the profile has no post-up hook, it's
+    # the last stanza of the file made by create-vrouter.sh
+    line = "    post-up " + PERF_PROFILE_SCRIPT
+    try:
+        with open(VROUTER_INTERFACES_CFG) as f:
+            content = f.read()
+    except IOError:
+        log("{} is absent, performance profile is not applied on start of "
+            "vhost0".format(VROUTER_INTERFACES_CFG), level=WARNING)
+        return
+    if line in content.splitlines():
+        return
+    with open(VROUTER_INTERFACES_CFG, "w") as f:
+        f.write(content.rstrip("\n") + "\n" + line + "\n")
+    log("Performance profile is added to post-up of vhost0")
+
+
+def apply_perf_profile():
+    if not config.get("vhost-ready") or not write_perf_profile():
+        # it's applied when vhost0 is configured
+        return
+    _add_perf_profile_hook()
+    check_call([PERF_PROFILE_SCRIPT])
+
+
+def _vrouter_auto_params():
+    # flow table takes about 1% of RAM, but not less than default 512K
+    ram = get_total_ram()
+    flows = max(ram // 100 // FLOW_ENTRY_SIZE, 1)
+    flows = min(max(1 << (flows.bit_length() - 1), 524288), 8388608)
+    return {
+        "vr_flow_entries": flows,
+        "vr_oflow_entries": flows // 8,
+        "vr_bridge_entries": max(flows // 2, 262144),
+        "vr_mpls_labels": min(max((ram >> 30) * 128, 5120), 65536),
+    }
+
+
+def _valid_vrouter_param(value):
+    value = str(value)
+    return value == "auto" or (value.isdigit() and int(value) > 0)
+
+
+def check_vrouter_params():
+    """Blocks the unit if vrouter table sizes are invalid.
+
+    Returns False then.
+    """
+    invalid = [option for _, option in VROUTER_PARAMS
+               if config.get(option)
+               and not _valid_vrouter_param(config.get(option))]
+    if invalid:
+        status_set("blocked", "Invalid value of {}: positive integer or "
+                   "'auto' is expected".format(", ".join(invalid)))
+        return False
+    return True
+
+
+def get_vrouter_params():
+    """Returns vrouter table sizes set by options, 'auto' sizes by RAM.
+
+    Invalid values are skipped, unit is blocked by them.
+    """
+    params = dict()
+    auto = None
+    for param, option in VROUTER_PARAMS:
+        value = config.get(option)
+        if not value or not _valid_vrouter_param(value):
+            continue
+        if value == "auto":
+            auto = auto or _vrouter_auto_params()
+            params[param] = auto[param]
+        else:
+            params[param] = int(value)
+    return params
+
+
+def write_vrouter_module_conf():
+    """Writes vrouter module parameters, they are applied on its load."""
+    params = get_vrouter_params()
+    if not params:
+        if os.path.exists(VROUTER_MODULE_CONF):
+            os.remove(VROUTER_MODULE_CONF)
+        return
+    options = " ".join("{}={}".format(param, params[param])
+                       for param, _ in VROUTER_PARAMS if param in params)
+    write_file(VROUTER_MODULE_CONF, "options vrouter {}\n".format(options),
+               perms=0o644)
+
+
+def _vrouter_params_pending():
+    # loaded module shows its parameters in sysfs
+    for param, value in get_vrouter_params().items():
+        path = "/sys/module/vrouter/parameters/" + param
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            if f.read().strip() != str(value):
+                return True
+    return False
+
+
 def drop_caches():
     """Clears OS pagecache"""
     log("Clearing pagecache")
@@ -207,6 +407,14 @@ def update_vrouter_provision_status():
         and info.get("cloud_orchestrator"))
     if config.get("vrouter-expected-provision-state"):
         if ready and not config.get("vrouter-provisioned"):
+            if reconciler.enabled():
+                # result is applied by update-status run by reconciler
+                result = _reconcile_provisioning("add")
+                if result:
+                    config["vrouter-provisioned"] = True
+                elif result is not None:
+                    log("Couldn't provision vrouter", level=WARNING)
+                return
             try:
                 provision_vrouter("add")
                 config["vrouter-provisioned"] = True
@@ -214,6 +422,19 @@ def update_vrouter_provision_status():
                 # vrouter is not up yet
                 log("Couldn't provision vrouter: " + str(e), level=WARNING)
     elif config.get("vrouter-provisioned"):
+        if not get_controller_addresses():
+            # the last controller is gone, there is nothing to delete from
+            log("There are no API servers to unprovision vrouter at")
+            config["vrouter-provisioned"] = False
+            return
+        if reconciler.enabled():
+            # flag is cleared only on success, so failed task is retried
+            result = _reconcile_provisioning("del")
+            if result:
+                config["vrouter-provisioned"] = False
+            elif result is not None:
+                log("Couldn't unprovision vrouter", level=WARNING)
+            return
         try:
             provision_vrouter("del")
         except Exception as e:
@@ -221,43 +442,116 @@ def update_vrouter_provision_status():
         config["vrouter-provisioned"] = False
 
 
-def provision_vrouter(op, self_ip=None):
+def _order_api_ips(api_ips):
+    """Moves API servers that failed recently to the end of the list"""
+    failures = _load_json_from_config("api-failures")
+    now = time()
+    failures = dict((api_ip, failed) for api_ip, failed in failures.items()
+                    if now - failed < API_FAILURE_MEMORY)
+    config["api-failures"] = json.dumps(failures)
+    # healthy servers keep relation order, failed ones go from the oldest
+    # failure to the latest one
+    return sorted(api_ips, key=lambda api_ip: failures.get(api_ip, 0))
+
+
+def _update_api_failures(failed_ips, good_ip=None):
+    failures = _load_json_from_config("api-failures")
+    now = time()
+    for api_ip in failed_ips:
+        failures[api_ip] = now
+    failures.pop(good_ip, None)
+    config["api-failures"] = json.dumps(failures)
+
+
+def _provision_request(op, self_ip=None):
     ip = self_ip if self_ip else get_control_network_ip()
-    api_ips = get_controller_addresses()
-    api_port = config.get("api_port")
-    identity = _load_json_from_config("auth_info")
-    params = [
-        "contrail-provision-vrouter",
-        "--host_name", gethostname(),
-        "--host_ip", ip,
-        "--api_server_port", str(api_port),
-        "--oper", op,
-        "--api_server_use_ssl", "false"]
-    # api_server_use_ssl is needed only if contrail-api behind haproxy with
-    # ssl termination
-    if "keystone_admin_user" in identity:
-        params += [
-            "--admin_user", identity.get("keystone_admin_user"),
-            "--admin_password", identity.get("keystone_admin_password"),
-            "--admin_tenant_name", identity.get("keystone_admin_tenant")]
-    if config["dpdk"] and op == "add":
-        params.append("--dpdk_enabled")
-    # add API IP at the end to be able to substitute it for each server
-    params += ["--api_server_ip", ""]
+    api_ips = _order_api_ips(get_controller_addresses())
+    name = gethostname()
+    if op == "add":
+        calls = [["add_virtual_router", [name, ip, bool(config["dpdk"])]]]
+    else:
+        calls = [["del_virtual_router", [name]]]
+    log("{} vrouter {}. API-IPs {}".format(op, ip, api_ips))
+    return {
+        "servers": api_ips,
+        "port": config.get("api_port"),
+        "identity": _load_json_from_config("auth_info"),
+        "insecure": bool(config.get("keystone-insecure")),
+        "calls": calls,
+    }
+
+
+def _reconcile_provisioning(op):
+    """Hands vrouter operation to the reconciler, returns as reconcile does.
+
+    Request has credentials, so it's passed in a file readable only by root.
+    Failures of API servers in the reconciler are remembered like hook's
+    ones when the result is taken.
+    """
+    request = json.dumps(_provision_request(op), sort_keys=True)
+    path = reconciler.write_private("provision-vrouter", request)
+    result = reconciler.reconcile(
+        "provision-vrouter", [[contrail_api_utils.command(path)]],
+        timeout=65, delay=20)
+    if result is not None:
+        good_ip, failed_ips = contrail_api_utils.read_result(path)
+        _update_api_failures(failed_ips, good_ip)
+    return result
+
+
+def provision_vrouter(op, self_ip=None):
+    request = _provision_request(op, self_ip)
+    api_ips = request["servers"]
+    if not api_ips:
+        # last controller is gone, there is nothing to call
+        log("There are no API servers for vrouter operation '{}'".format(op))
+        return
 
     @retry(timeout=65, delay=20)
     def _call():
-        for api_ip in api_ips:
-            params[-1] = api_ip
-            check_call(params)
-            log("vrouter operation '{}' was successful at API={}"
-                .format(op, api_ip))
-            break
+        index, failed = contrail_api_utils.run_request(request)
+        for failed_index, e in failed:
+            log("vrouter operation '{}' failed at API={}: {}"
+                .format(op, api_ips[failed_index], e), level=WARNING)
+        _update_api_failures([api_ips[i] for i, _ in failed],
+                             api_ips[index] if index is not None else None)
+        if index is None:
+            raise Exception("vrouter operation '{}' failed at all API servers"
+                            .format(op))
+        log("vrouter operation '{}' was successful at API={}"
+            .format(op, api_ips[index]))
 
-    log("{} vrouter {}. API-IPs {}".format(op, ip, api_ips))
     _call()
 
 
+def _agent_cores():
+    # cores busy with DPDK forwarding are left out for agent's threads
+    cores = set(dpdk_utils.online_cpus())
+    if config["dpdk"]:
+        cores -= set(dpdk_utils.parse_coremask(get_dpdk_coremask()))
+    return max(len(cores), 1)
+
+
+def get_agent_threads():
+    """Returns agent's task and flow thread counts.
+
+    With 'auto' task scheduler gets all cores left after DPDK coremask and
+    flow handling gets a quarter of them, up to 8 threads.
+    """
+    threads = dict()
+    cores = None
+    for key, option in (("task_thread_count", "agent-task-thread-count"),
+                        ("flow_thread_count", "agent-flow-thread-count")):
+        value = config.get(option)
+        if value == "auto":
+            cores = cores or _agent_cores()
+            value = (cores if key == "task_thread_count"
+                     else min(max(cores // 4, 1), 8))
+        if value:
+            threads[key] = int(value)
+    return threads
+
+
 def get_controller_addresses():
     return [relation_get("private-address", unit, rid)
             for rid in relation_ids("contrail-controller")
@@ -296,6 +590,12 @@ def get_context():
         ctx["physical_interface_address"] = config["dpdk-pci"]
         ctx["physical_interface_mac"] = config["dpdk-mac"]
         ctx["physical_uio_driver"] = config.get("dpdk-driver")
+    ctx["vrouter_params"] = sorted(get_vrouter_params().items())
+    ctx.update(get_agent_threads())
+    ctx["max_vm_flows"] = config.get("agent-max-vm-flows")
+    ctx["max_system_linklocal_flows"] = config.get(
+        "agent-max-system-linklocal-flows")
+    ctx["flow_cache_timeout"] = config.get("agent-flow-cache-timeout")
 
     plugin_ips = json.loads(config.get("plugin-ips", "{}"))
     my_ip = unit_get("private-address")
@@ -352,13 +652,18 @@ def update_unit_status():
         else:
             status_set("blocked", "Missing relation to contrail-controller")
 
+    if config["dpdk"] and config.get("dpdk-mempool-error"):
+        status_set("blocked", config["dpdk-mempool-error"])
+        return
+    if not check_vrouter_params():
+        return
+
     status, _ = _get_agent_status()
     if status == 'initializing':
         # some hacks
         log("Run agent hack: service restart")
-        service_restart("contrail-vrouter-agent")
-        sleep(10)
-        status, msg = _get_agent_status()
+        restart_service("contrail-vrouter-agent")
+        status, msg = _wait_agent_status(timeout=10)
         if status == 'initializing' and "(No Configuration for self)" in msg:
             log("Run agent hack: reinitialize config client")
             ip = config.get("api_ip")
@@ -377,23 +682,47 @@ def update_unit_status():
                        .format(proto=proto, ip=ip))
                 params.append(url)
                 check_call(params)
-                sleep(5)
-                status, _ = _get_agent_status()
+                status, _ = _wait_agent_status(timeout=5)
             except Exception as e:
                 log("Reinitialize returns error: " + str(e))
 
     if status == 'active':
+        if not config["dpdk"] and _vrouter_params_pending():
+            status_set("active", "Unit is ready (vrouter module parameters "
+                       "will be applied after module reload)")
+            return
         status_set("active", "Unit is ready")
         return
 
     status_set("waiting", "vrouter-agent is not up")
 
 
+def _wait_agent_status(timeout):
+    """Waits until agent becomes active and returns its last status"""
+    statuses = list()
+
+    def _is_active():
+        statuses.append(_get_agent_status())
+        return statuses[-1][0] == "active"
+
+    wait_until(_is_active, timeout=timeout)
+    return statuses[-1]
+
+
 def _get_agent_status():
-    """ Analyzes output of 'contrail-status' utility
+    """ Analyzes introspect of agent or output of 'contrail-status' utility
 
     returns status from agent service:
     """
+    certs = None
+    if config.get("ssl_enabled", False):
+        certs = {"certfile": SERVER_CERT, "keyfile": SERVER_KEY,
+                 "cafile": CA_CERT}
+    status = probe_service("contrail-vrouter-agent", "127.0.0.1", certs)
+    if status:
+        log("vrouter-agent introspect: {} {}".format(*status))
+        return status
+
     try:
         output = check_output("contrail-status", shell=True)
     except:
@@ -423,7 +752,8 @@ def _get_args_from_command_string(original_args):
     iter_args = iter(enumerate(args_list))
     # divide dpdk arguments and other
     for index, arg in iter_args:
-        if arg in ["--vr_mempool_sz", "--dpdk_txd_sz", "--dpdk_rxd_sz"]:
+        if arg in ["--vr_mempool_sz", "--dpdk_txd_sz", "--dpdk_rxd_sz",
+                   "--socket-mem"] + ["--" + p for p, _ in VROUTER_PARAMS]:
             command_args_dict[arg] = args_list[index+1]
             next(iter_args)
         else:
@@ -433,20 +763,114 @@ def _get_args_from_command_string(original_args):
 
 def _dpdk_args_from_config_to_dict():
     config_args_dict = {}
-    dpdk_main_mempool_size = config.get("dpdk-main-mempool-size")
-    if dpdk_main_mempool_size:
-        config_args_dict["--vr_mempool_sz"] = dpdk_main_mempool_size
-    dpdk_pmd_txd_size = config.get("dpdk-pmd-txd-size")
-    if dpdk_pmd_txd_size:
-        config_args_dict["--dpdk_txd_sz"] = dpdk_pmd_txd_size
-    dpdk_pmd_rxd_size = config.get("dpdk-pmd-rxd-size")
-    if dpdk_pmd_rxd_size:
-        config_args_dict["--dpdk_rxd_sz"] = dpdk_pmd_rxd_size
+    sizes = None
+    for option, arg in (("dpdk-main-mempool-size", "--vr_mempool_sz"),
+                        ("dpdk-pmd-txd-size", "--dpdk_txd_sz"),
+                        ("dpdk-pmd-rxd-size", "--dpdk_rxd_sz")):
+        value = config.get(option)
+        if value == "auto":
+            sizes = sizes or get_dpdk_sizes()
+            value = sizes[arg.lstrip("-")]
+            # vRouter's default is used when mempool doesn't fit at all
+            value = str(value) if value else None
+        if value:
+            config_args_dict[arg] = value
+    for param, value in get_vrouter_params().items():
+        config_args_dict["--" + param] = str(value)
+    if config.get("dpdk-coremask") == "auto":
+        config_args_dict["--socket-mem"] = dpdk_utils.socket_mem(
+            _dpdk_numa_node(), dpdk_utils.numa_nodes())
     return config_args_dict
 
 
-def set_dpdk_options():
+def _dpdk_numa_node():
+    # NIC is bound to DPDK driver after vhost0 is created, so its NUMA node
+    # is read by PCI address then
+    pci_address = config.get("dpdk-pci")
+    if pci_address and pci_address != "0000:00:00.0":
+        return dpdk_utils.pci_numa_node(pci_address)
+    iface = (config.get("vhost-physical") or config.get("physical-interface")
+             or _get_default_gateway_iface())
+    return dpdk_utils.iface_numa_node(iface)
+
+
+def get_dpdk_coremask():
+    """Returns vRouter CPU affinity.
+
+    For 'auto' cores are chosen on NUMA node of the NIC, skipping core 0 and
+    hyperthread siblings.
+    """
     mask = config.get("dpdk-coremask")
+    if mask != "auto":
+        return mask
+    node = _dpdk_numa_node()
+    cores = dpdk_utils.select_cores(node, config.get("dpdk-core-count") or 1)
+    if not cores:
+        log("There are no free cores on NUMA node {}, core 0 is used"
+            .format(node), level=WARNING)
+        return "0"
+    log("Cores {} on NUMA node {} are chosen for vRouter".format(cores, node))
+    return ",".join(str(core) for core in cores)
+
+
+def get_dpdk_sizes():
+    """Returns automatic sizes of vRouter's mempool and descriptor rings.
+
+    They are derived from NIC's queues, forwarding cores, vhost MTU and
+    vRouter's hugepage memory on NUMA node of the NIC.
+    """
+    iface = config.get("vhost-physical")
+    queues = ((dpdk_utils.nic_queues(iface) if iface else None)
+              or config.get("dpdk-nic-queues"))
+    cores = len(dpdk_utils.parse_coremask(get_dpdk_coremask()))
+    mtu = config.get("vhost-mtu")
+    mtu = int(mtu) if mtu and mtu.isdigit() else 1500
+    node = _dpdk_numa_node()
+    memory = dpdk_utils.SOCKET_MEM
+    node_memory = dpdk_utils.node_hugepages_memory(node)
+    if node_memory is not None:
+        memory = min(memory, node_memory)
+    sizes = dpdk_utils.dpdk_sizes(queues, cores, mtu, memory)
+    sizes["numa_node"] = node
+    if sizes["vr_mempool_sz"] is None:
+        log("Mempool for {} cores and {} queues can't fit into {} MB on "
+            "NUMA node {} even with minimal size {}".format(
+                cores, sizes["queues"], memory, node,
+                dpdk_utils.MIN_MEMPOOL_SIZE), level=ERROR)
+    elif not sizes["fits"]:
+        log("Mempool for {} cores and {} queues doesn't fit into {} MB on "
+            "NUMA node {}, it's reduced to {}".format(
+                cores, sizes["queues"], memory, node,
+                sizes["vr_mempool_sz"]), level=WARNING)
+    return sizes
+
+
+def show_dpdk_sizes():
+    """Sets vRouter's mempool and ring sizes as a result of the action."""
+    if not config.get("dpdk"):
+        action_fail("DPDK vRouter is not used")
+        return
+    action_set({
+        "sizes": json.dumps(get_dpdk_sizes(), sort_keys=True),
+        "args": json.dumps(_dpdk_args_from_config_to_dict(), sort_keys=True),
+    })
+
+
+def _check_dpdk_mempool():
+    """Remembers the problem if vRouter's mempool can't fit into memory."""
+    config.pop("dpdk-mempool-error", None)
+    if config.get("dpdk-main-mempool-size") != "auto":
+        return
+    sizes = get_dpdk_sizes()
+    if sizes["vr_mempool_sz"] is None:
+        config["dpdk-mempool-error"] = (
+            "vRouter's mempool doesn't fit into {} MB of hugepages on NUMA "
+            "node {}".format(sizes["memory_mb"], sizes["numa_node"]))
+
+
+def set_dpdk_options():
+    _check_dpdk_mempool()
+    mask = get_dpdk_coremask()
     service = "/usr/bin/contrail-vrouter-dpdk"
     mask_arg = mask if mask.startswith("0x") else "-c " + mask
     if not init_is_systemd():
@@ -483,8 +907,9 @@ def set_dpdk_options():
         dpdk_args_dict.update(config_args_dict)
         break
     else:
-        dpdk_args_dict = _dpdk_args_from_config_to_dict()
-        other_args = " --no-daemon --socket-mem 1024"
+        dpdk_args_dict = {"--socket-mem": "1024"}
+        dpdk_args_dict.update(_dpdk_args_from_config_to_dict())
+        other_args = " --no-daemon"
     dpdk_args_string = " ".join(" ".join(_) for _ in dpdk_args_dict.items())
     args = dpdk_args_string + other_args
 
@@ -518,6 +943,54 @@ def configure_hugepages():
     check_call(["sysctl", "-w", "vm.nr_hugepages={}".format(pages)])
     check_call(["sysctl", "-w", "vm.max_map_count={}".format(map_max)])
     check_call(["sysctl", "-w", "vm.hugetlb_shm_group=0".format(pages)])
+    place_hugepages(pages)
+
+
+def place_hugepages(pages):
+    """Reserves hugepages for vRouter on NUMA node of the NIC.
+
+    It's done only for 'auto' coremask, kernel splits pages evenly
+    between nodes otherwise.
+    """
+    if config.get("dpdk-coremask") != "auto":
+        _save_node_hugepages(None)
+        return
+    min_pages = dpdk_utils.SOCKET_MEM * 1024 // dpdk_utils.HUGEPAGE_SIZE_KB
+    pages = dpdk_utils.hugepages_per_node(
+        int(pages), _dpdk_numa_node(), dpdk_utils.numa_nodes(), min_pages)
+    dpdk_utils.set_node_hugepages(pages)
+    _save_node_hugepages(pages)
+    log("Hugepages per NUMA node: {}".format(pages))
+
+
+def _save_node_hugepages(pages):
+    """Keeps placement of hugepages after reboot by a boot-time unit.
+
+    Placement is removed if pages is None.
+    """
+    path = os.path.join("/etc/systemd/system", HUGEPAGES_SERVICE + ".service")
+    if not init_is_systemd():
+        if pages:
+            log("Hugepages per NUMA node are not kept after reboot without "
+                "systemd", level=WARNING)
+        return
+    content = dpdk_utils.hugepages_service(pages) if pages else None
+    if not content:
+        if os.path.exists(path):
+            check_call(["systemctl", "disable", HUGEPAGES_SERVICE])
+            os.remove(path)
+            check_call(["systemctl", "daemon-reload"])
+        return
+
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                return
+    with open(path, "w") as f:
+        f.write(content)
+    check_call(["systemctl", "daemon-reload"])
+    # pages are placed already, the unit is run at next boot
+    check_call(["systemctl", "enable", HUGEPAGES_SERVICE])
 
 
 def get_hugepages():
@@ -548,9 +1021,9 @@ def fix_libvirt():
 
 
 def tls_changed(cert, key, ca):
-    files = {"/etc/contrail/ssl/certs/server.pem": cert,
-             "/etc/contrail/ssl/private/server-privkey.pem": key,
-             "/etc/contrail/ssl/certs/ca-cert.pem": ca}
+    files = {SERVER_CERT: cert,
+             SERVER_KEY: key,
+             CA_CERT: ca}
     changed = False
     for cfile in files:
         data = files[cfile]
@@ -566,5 +1039,6 @@ def tls_changed(cert, key, ca):
     config["ssl_enabled"] = (cert is not None and len(cert) > 0)
     config.save()
     write_configs()
-    service_restart("contrail-vrouter-agent")
-    service_restart("contrail-vrouter-nodemgr")
+    # restarts are merged with ones requested by write_configs
+    schedule_restart("contrail-vrouter-agent")
+    schedule_restart("contrail-vrouter-nodemgr")
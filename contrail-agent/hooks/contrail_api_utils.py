@@ -0,0 +1,378 @@
+"""Lightweight client of Contrail config API for provisioning from hooks.
+
+It replaces contrail-provision-vrouter and provision_control.py tools:
+objects are created, updated or deleted idempotently over one kept HTTP
+connection per server, and Keystone token is issued once per hook.
+It's also run by the reconciler with a request file:
+    contrail_api_utils.py <request.json>
+"""
+
+import functools
+import json
+import os
+import ssl
+import sys
+import threading
+import time
+
+from six.moves import http_client, queue
+
+from charmhelpers.core.hookenv import log, WARNING
+
+from introspect_utils import http_request
+
+
+API_TIMEOUT = 10
+DEFAULT_GSC = "default-global-system-config"
+IP_FABRIC_RI = [
+    "default-domain", "default-project", "ip-fabric", "__default__"]
+BGP_ADDRESS_FAMILIES = [
+    "route-target", "inet-vpn", "e-vpn", "erm-vpn", "inet6-vpn"]
+# API servers are called concurrently, next one is started when
+# the previous one fails or doesn't answer in the hedge delay
+CONCURRENCY = 2
+HEDGE_DELAY = 5
+
+_connections = dict()
+_tokens = dict()
+_tokens_lock = threading.Lock()
+
+
+class APIError(Exception):
+
+    def __init__(self, status, reason, body=None):
+        super(APIError, self).__init__("{} {}: {}".format(
+            status, reason, body))
+        self.status = status
+
+
+def _ssl_context(cadata=None, insecure=False):
+    if insecure:
+        log("Certificate of Keystone is not verified", level=WARNING)
+        return ssl._create_unverified_context()
+    # system CAs are used if there is no CA in the relation
+    return ssl.create_default_context(cadata=cadata)
+
+
+def _connection(protocol, host, port, cadata=None, insecure=False):
+    # connections are kept for all requests of the hook
+    key = (protocol, host, int(port))
+    conn = _connections.get(key)
+    if conn is None:
+        if protocol == "https":
+            context = _ssl_context(cadata, insecure)
+            conn = http_client.HTTPSConnection(
+                host, int(port), timeout=API_TIMEOUT, context=context)
+        else:
+            conn = http_client.HTTPConnection(
+                host, int(port), timeout=API_TIMEOUT)
+        _connections[key] = conn
+    return conn
+
+
+def _request(conn, method, path, body=None, headers=None):
+    headers = dict(headers or {})
+    if body is not None:
+        body = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+    response, data = http_request(conn, method, path, body, headers)
+    if response.status >= 300:
+        raise APIError(response.status, response.reason,
+                       data.decode("UTF-8", "replace")[:500])
+    return response, json.loads(data.decode("UTF-8")) if data else None
+
+
+def _keystone_request(identity):
+    if int(identity["keystone_api_version"]) == 2:
+        return {
+            "auth": {
+                "tenantName": identity["keystone_admin_tenant"],
+                "passwordCredentials": {
+                    "username": identity["keystone_admin_user"],
+                    "password": identity["keystone_admin_password"]}}}
+    user_domain = identity.get("keystone_user_domain_name")
+    # user and project could be in different domains
+    project_domain = (identity.get("keystone_project_domain_name")
+                      or user_domain)
+    project = (identity.get("keystone_project_name")
+               or identity["keystone_admin_tenant"])
+    return {
+        "auth": {
+            "identity": {
+                "methods": ["password"],
+                "password": {
+                    "user": {
+                        "name": identity["keystone_admin_user"],
+                        "domain": {"name": user_domain},
+                        "password": identity["keystone_admin_password"]}}},
+            "scope": {
+                "project": {
+                    "name": project,
+                    "domain": {"name": project_domain}}}}}
+
+
+def get_token(identity, insecure=False):
+    """Returns Keystone token, it's issued only once for the hook.
+
+    Certificate of Keystone isn't verified only if insecure is set.
+    """
+    key = (identity["keystone_ip"], identity["keystone_admin_user"],
+           identity["keystone_admin_tenant"],
+           identity.get("keystone_project_name"))
+    # requests to several API servers could be made concurrently
+    with _tokens_lock:
+        token = _tokens.get(key)
+        if not token:
+            token = _issue_token(identity, insecure)
+            _tokens[key] = token
+    return token
+
+
+def _issue_token(identity, insecure=False):
+    conn = _connection(identity["keystone_protocol"],
+                       identity["keystone_ip"],
+                       identity["keystone_public_port"],
+                       identity.get("keystone_ssl_ca"), insecure)
+    response, content = _request(
+        conn, "POST", "/" + identity["keystone_api_tokens"],
+        _keystone_request(identity))
+    if int(identity["keystone_api_version"]) == 2:
+        token = content["access"]["token"]["id"]
+    else:
+        token = response.getheader("X-Subject-Token")
+    return token
+
+
+def _differs(fields, obj):
+    for key, value in fields.items():
+        if isinstance(value, dict):
+            current = obj.get(key) or dict()
+            if any(current.get(k) != v for k, v in value.items()):
+                return True
+        elif obj.get(key) != value:
+            return True
+    return False
+
+
+class ConfigAPI(object):
+    """Client of the config API server.
+
+    identity is auth_info from contrail-auth relation, requests are made
+    without token if it has no Keystone credentials (no-auth mode).
+    insecure disables verification of Keystone certificate.
+    """
+
+    def __init__(self, host, port=8082, identity=None, insecure=False):
+        self.conn = _connection("http", host, port)
+        self.insecure = insecure
+        if identity and identity.get("keystone_admin_user"):
+            self.identity = identity
+        else:
+            self.identity = None
+
+    def _call(self, method, path, body=None):
+        if not self.identity:
+            return _request(self.conn, method, path, body)[1]
+        for attempt in range(2):
+            headers = {
+                "X-Auth-Token": get_token(self.identity, self.insecure)}
+            try:
+                return _request(self.conn, method, path, body, headers)[1]
+            except APIError as e:
+                if e.status != 401 or attempt:
+                    raise
+                # token is expired or revoked, so issue new one
+                _tokens.clear()
+
+    def fq_name_to_id(self, obj_type, fq_name):
+        try:
+            content = self._call("POST", "/fqname-to-id",
+                                 {"type": obj_type, "fq_name": fq_name})
+        except APIError as e:
+            if e.status == 404:
+                return None
+            raise
+        return content["uuid"]
+
+    def read(self, obj_type, uuid):
+        return self._call("GET", "/{}/{}".format(obj_type, uuid))[obj_type]
+
+    def ensure(self, obj_type, fq_name, parent_type, fields):
+        """Creates the object or updates its fields if they differ.
+
+        Fields with struct values are compared and updated by their keys.
+        Returns uuid of the object.
+        """
+        uuid = self.fq_name_to_id(obj_type, fq_name)
+        if uuid is None:
+            obj = dict(fields, fq_name=fq_name, parent_type=parent_type)
+            try:
+                content = self._call("POST", "/{}s".format(obj_type),
+                                     {obj_type: obj})
+                log("{} {} is created".format(obj_type, fq_name[-1]))
+                return content[obj_type]["uuid"]
+            except APIError as e:
+                # it could be created concurrently by another unit
+                if e.status != 409:
+                    raise
+                uuid = self.fq_name_to_id(obj_type, fq_name)
+
+        obj = self.read(obj_type, uuid)
+        if not _differs(fields, obj):
+            return uuid
+        update = dict()
+        for key, value in fields.items():
+            if isinstance(value, dict):
+                value = dict(obj.get(key) or dict(), **value)
+            update[key] = value
+        self._call("PUT", "/{}/{}".format(obj_type, uuid), {obj_type: update})
+        log("{} {} is updated".format(obj_type, fq_name[-1]))
+        return uuid
+
+    def remove(self, obj_type, fq_name):
+        """Deletes the object if it exists."""
+        uuid = self.fq_name_to_id(obj_type, fq_name)
+        if uuid is None:
+            return
+        try:
+            self._call("DELETE", "/{}/{}".format(obj_type, uuid))
+        except APIError as e:
+            if e.status != 404:
+                raise
+        log("{} {} is deleted".format(obj_type, fq_name[-1]))
+
+    def add_virtual_router(self, name, ip, dpdk=False):
+        return self.ensure(
+            "virtual-router", [DEFAULT_GSC, name], "global-system-config", {
+                "virtual_router_ip_address": ip,
+                "virtual_router_dpdk_enabled": bool(dpdk)})
+
+    def del_virtual_router(self, name):
+        self.remove("virtual-router", [DEFAULT_GSC, name])
+
+    def set_global_asn(self, asn):
+        uuid = self.fq_name_to_id("global-system-config", [DEFAULT_GSC])
+        obj = self.read("global-system-config", uuid)
+        if obj.get("autonomous_system") != int(asn):
+            self._call("PUT", "/global-system-config/" + uuid, {
+                "global-system-config": {"autonomous_system": int(asn)}})
+            log("Global ASN is set to {}".format(asn))
+
+    def add_bgp_router(self, name, ip, asn):
+        return self.ensure(
+            "bgp-router", IP_FABRIC_RI + [name], "routing-instance", {
+                "bgp_router_parameters": {
+                    "vendor": "contrail",
+                    "router_type": "control-node",
+                    "autonomous_system": int(asn),
+                    "identifier": ip,
+                    "address": ip,
+                    "port": 179,
+                    "address_families": {"family": BGP_ADDRESS_FAMILIES}}})
+
+
+def run_first_successful(funcs, concurrency, hedge_delay):
+    """Runs functions in threads until the first one succeeds.
+
+    Next function is started when a running one fails or when no one has
+    finished in hedge_delay seconds, but no more than concurrency functions
+    are run at once. Functions left running after success are not waited
+    for, so they must be idempotent.
+    Returns index of the successful function (None if all of them failed)
+    and list of failed indexes with exceptions.
+    """
+    results = queue.Queue()
+
+    def _run(index):
+        try:
+            funcs[index]()
+            results.put((index, None))
+        except Exception as e:
+            results.put((index, e))
+
+    pending = list(range(len(funcs)))
+    running = 0
+    failed = list()
+    last_start = 0
+    while pending or running:
+        now = time.time()
+        if (pending and running < concurrency
+                and (not running or now - last_start >= hedge_delay)):
+            thread = threading.Thread(target=_run, args=(pending.pop(0),))
+            thread.daemon = True
+            thread.start()
+            running += 1
+            last_start = now
+            continue
+        try:
+            index, error = results.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        running -= 1
+        if error is None:
+            return index, failed
+        failed.append((index, error))
+    return None, failed
+
+
+def run_request(request):
+    """Makes calls of the request at the first API server where they succeed.
+
+    Request is a dict with 'servers', 'port', 'identity', 'insecure' and
+    'calls' - list of ConfigAPI methods with their arguments. Servers are
+    raced, so the one that is down doesn't delay the calls by its connection
+    timeout. Returns the same as run_first_successful.
+    """
+    def _call(server):
+        api = ConfigAPI(server, request.get("port") or 8082,
+                        request.get("identity"), request.get("insecure"))
+        for method, args in request["calls"]:
+            getattr(api, method)(*args)
+
+    return run_first_successful(
+        [functools.partial(_call, server) for server in request["servers"]],
+        CONCURRENCY, HEDGE_DELAY)
+
+
+def command(path):
+    """Returns command that runs the request from the file."""
+    return ["/usr/bin/env", "python",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "contrail_api_utils.py"),
+            path]
+
+
+def read_result(path):
+    """Returns good and failed API servers of the last run of the request.
+
+    Good server is None if the request wasn't run or failed everywhere.
+    """
+    try:
+        with open(path + ".result") as f:
+            result = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None, []
+    return result["good"], result["failed"]
+
+
+def main():
+    path = sys.argv[1]
+    with open(path) as f:
+        request = json.load(f)
+    if not request["servers"]:
+        sys.stderr.write("There are no API servers, nothing is done\n")
+        return 0
+    servers = request["servers"]
+    index, failed = run_request(request)
+    for failed_index, e in failed:
+        sys.stderr.write("API server {} failed: {}\n".format(
+            servers[failed_index], e))
+    # hook reads it to order servers as after its own calls
+    with open(path + ".result", "w") as f:
+        json.dump({"good": servers[index] if index is not None else None,
+                   "failed": [servers[i] for i, _ in failed]}, f)
+    return 0 if index is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Host topology for vRouter: NUMA nodes, cores and hugepages.
+
+All functions take root of sysfs, so they can be run against a copy of
+sysfs tree.
+"""
+
+import os
+
+SYSFS = "/sys"
+HUGEPAGE_SIZE_KB = 2048
+# memory for vRouter on NUMA node of its NIC, in MB
+SOCKET_MEM = 1024
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+def parse_cpu_list(value):
+    """Parses list like '0-3,8,10-11' used by sysfs and taskset."""
+    cpus = list()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes(sysfs=SYSFS):
+    value = _read(os.path.join(sysfs, "devices/system/node/online"))
+    return parse_cpu_list(value) if value else [0]
+
+
+def _numa_node(path):
+    value = _read(path)
+    # -1 means that platform doesn't report NUMA node of the device
+    if value is None or int(value) < 0:
+        return 0
+    return int(value)
+
+
+def pci_numa_node(pci_address, sysfs=SYSFS):
+    """Returns NUMA node of PCI device, it's known after DPDK binding."""
+    return _numa_node(os.path.join(
+        sysfs, "bus/pci/devices", pci_address, "numa_node"))
+
+
+def iface_numa_node(iface, sysfs=SYSFS):
+    return _numa_node(os.path.join(
+        sysfs, "class/net", iface, "device/numa_node"))
+
+
+def node_cpus(node, sysfs=SYSFS):
+    value = _read(os.path.join(
+        sysfs, "devices/system/node/node{}/cpulist".format(node)))
+    if value is None:
+        # kernel without NUMA support
+        value = _read(os.path.join(sysfs, "devices/system/cpu/online"), "0")
+    return parse_cpu_list(value)
+
+
+def online_cpus(sysfs=SYSFS):
+    return parse_cpu_list(
+        _read(os.path.join(sysfs, "devices/system/cpu/online"), "0"))
+
+
+def _siblings(cpu, sysfs):
+    value = _read(os.path.join(
+        sysfs,
+        "devices/system/cpu/cpu{}/topology/thread_siblings_list".format(cpu)))
+    return set(parse_cpu_list(value)) if value else set([cpu])
+
+
+def select_cores(node, count, sysfs=SYSFS):
+    """Returns up to count forwarding cores on the NUMA node.
+
+    One thread of each physical core is taken, so forwarding threads don't
+    share cores. Core 0 with its hyperthread siblings is left for the host.
+    """
+    used = _siblings(0, sysfs)
+    cores = list()
+    for cpu in sorted(node_cpus(node, sysfs)):
+        if len(cores) >= count:
+            break
+        if cpu in used:
+            continue
+        cores.append(cpu)
+        used |= _siblings(cpu, sysfs)
+    return cores
+
+
+def hugepages_per_node(total, nic_node, nodes, min_pages):
+    """Splits hugepages between NUMA nodes.
+
+    Pages are split evenly like kernel does it, but NUMA node of the NIC
+    gets at least min_pages for vRouter if there are enough pages.
+    """
+    share = total // len(nodes)
+    pages = dict((node, share) for node in nodes)
+    pages[nic_node] += total - share * len(nodes)
+    for node in nodes:
+        deficit = min_pages - pages[nic_node]
+        if deficit <= 0:
+            break
+        if node == nic_node:
+            continue
+        moved = min(deficit, pages[node])
+        pages[node] -= moved
+        pages[nic_node] += moved
+    return pages
+
+
+def _node_hugepages_path(node, sysfs=SYSFS):
+    return os.path.join(
+        sysfs, "devices/system/node/node{}/hugepages/hugepages-{}kB/"
+        "nr_hugepages".format(node, HUGEPAGE_SIZE_KB))
+
+
+def _ordered(pages):
+    # nodes that give pages away are set first, so pages freed by them can
+    # be taken by the NIC's node
+    return sorted(pages.items(), key=lambda item: (item[1], item[0]))
+
+
+def set_node_hugepages(pages, sysfs=SYSFS):
+    for node, count in _ordered(pages):
+        path = _node_hugepages_path(node, sysfs)
+        if not os.path.exists(path):
+            continue
+        with open(path, "w") as f:
+            f.write(str(count))
+
+
+HUGEPAGES_SERVICE_TEMPLATE = """[Unit]
+Description=Hugepages of vRouter on NUMA nodes
+DefaultDependencies=no
+After=systemd-sysctl.service
+Before=docker.service contrail-vrouter-dpdk.service
+
+[Service]
+Type=oneshot
+{commands}
+
+[Install]
+WantedBy=sysinit.target
+"""
+
+
+def hugepages_service(pages, sysfs=SYSFS):
+    """Returns systemd unit that sets hugepages per node at boot.
+
+    Kernel splits vm.nr_hugepages from sysctl.d evenly between nodes, the
+    unit moves them as set_node_hugepages does it. Returns None if nodes
+    have no hugepages in sysfs.
+    """
+    commands = list()
+    for node, count in _ordered(pages):
+        path = _node_hugepages_path(node, sysfs)
+        if os.path.exists(path):
+            # failure on one node doesn't stop others
+            commands.append("ExecStart=-/bin/sh -c 'echo {} > {}'".format(
+                count, path))
+    if not commands:
+        return None
+    return HUGEPAGES_SERVICE_TEMPLATE.format(commands="\n".join(commands))
+
+
+def socket_mem(nic_node, nodes, mem=SOCKET_MEM):
+    """Returns --socket-mem value with memory only on the NIC's node."""
+    return ",".join(str(mem if node == nic_node else 0)
+                    for node in range(max(nodes) + 1))
+
+
+def parse_coremask(mask):
+    """Returns cores of taskset mask given as 0xF or as list like 0-2,4."""
+    if mask.startswith("0x"):
+        bits = int(mask, 16)
+        return [cpu for cpu in range(bits.bit_length()) if bits >> cpu & 1]
+    return parse_cpu_list(mask)
+
+
+def nic_queues(iface, sysfs=SYSFS):
+    """Returns number of Rx queues of the interface or None if unknown."""
+    try:
+        queues = os.listdir(os.path.join(sysfs, "class/net", iface, "queues"))
+    except OSError:
+        return None
+    return len([queue for queue in queues if queue.startswith("rx-")]) or None
+
+
+def node_hugepages_memory(node, sysfs=SYSFS):
+    """Returns memory of hugepages on the NUMA node in MB or None."""
+    value = _read(_node_hugepages_path(node, sysfs))
+    if value is None:
+        return None
+    return int(value) * HUGEPAGE_SIZE_KB // 1024
+
+
+# vRouter's mbuf has fixed data room, bigger packets are chained
+MBUF_DATA_SIZE = 2048
+MBUF_OVERHEAD = 128 + 64
+MEMPOOL_CACHE_SIZE = 256
+# mbufs held by vhost queues of instances
+VHOST_MBUFS = 8192
+MIN_MEMPOOL_SIZE = 16383
+# rest of vRouter's memory on the node is for its other pools
+MEMPOOL_MEMORY_SHARE = 0.5
+
+
+def _round_pow2(value):
+    return 1 << (max(int(value), 1).bit_length() - 1)
+
+
+def dpdk_sizes(queues, cores, mtu, memory):
+    """Sizes mempool and descriptor rings of vRouter.
+
+    queues is number of NIC's queues, cores - number of forwarding cores,
+    memory - vRouter's hugepage memory on NIC's NUMA node in MB. Rings are
+    shorter when there are more queues to keep buffered traffic the same,
+    mempool holds all rings, per-core caches and vhost queues and is
+    shrunk to fit its share of memory. If even the minimal mempool doesn't
+    fit, its size is None.
+    """
+    queues = max(1, min(queues or cores, cores))
+    ring = min(max(_round_pow2(4096 // queues), 512), 2048)
+    segments = -(-max(int(mtu), 1) // MBUF_DATA_SIZE)
+    mbufs = ((queues * 2 * ring + VHOST_MBUFS) * segments +
+             cores * MEMPOOL_CACHE_SIZE)
+    # DPDK mempool is optimal with 2^n - 1 elements
+    mempool = max((1 << mbufs.bit_length()) - 1, MIN_MEMPOOL_SIZE)
+    mbuf_size = MBUF_DATA_SIZE + MBUF_OVERHEAD
+    limit = int(memory * MEMPOOL_MEMORY_SHARE * 1024 * 1024 // mbuf_size)
+    fits = mempool <= limit
+    if not fits:
+        mempool = _round_pow2(limit + 1) - 1
+        if mempool < MIN_MEMPOOL_SIZE:
+            mempool = None
+    return {
+        "queues": queues,
+        "cores": cores,
+        "mtu": int(mtu),
+        "vr_mempool_sz": mempool,
+        "dpdk_txd_sz": ring,
+        "dpdk_rxd_sz": ring,
+        "mempool_memory_mb": (mempool * mbuf_size // (1024 * 1024)
+                              if mempool else None),
+        "memory_mb": memory,
+        "fits": fits,
+    }
+
+
+def cpu_mask(cpus):
+    """Returns mask of cpus in sysfs format: 32-bit hex words by commas."""
+    bits = sum(1 << cpu for cpu in cpus)
+    words = ["{:08x}".format(bits & 0xffffffff)]
+    bits >>= 32
+    while bits:
+        words.insert(0, "{:08x}".format(bits & 0xffffffff))
+        bits >>= 32
+    return ",".join(words)
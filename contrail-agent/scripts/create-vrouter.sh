@@ -6,13 +6,15 @@ ARG_BRIDGE=b
 ARG_DPDK=d
 ARG_HELP=h
 MTU=m
-OPTS=:${ARG_BRIDGE}${ARG_DPDK}${ARG_HELP}${MTU}:
+PERF=p
+OPTS=:${ARG_BRIDGE}${ARG_DPDK}${ARG_HELP}${MTU}:${PERF}:
 USAGE="\
-create-vrouter [-${ARG_BRIDGE}${ARG_DPDK}${ARG_HELP}] [-${MTU} mtu] [interface]
+create-vrouter [-${ARG_BRIDGE}${ARG_DPDK}${ARG_HELP}] [-${MTU} mtu] [-${PERF} script] [interface]
 Options:
   -$ARG_BRIDGE  remove bridge from interface if exists
   -$ARG_DPDK  configure DPDK vRouter
   -$MTU configure MTU for vhost0
+  -$PERF  run performance profile script after vhost0 is up
   -$ARG_HELP  print this message"
 
 configVRouter()
@@ -22,6 +24,7 @@ configVRouter()
 	# $3 - file path. bridge interface to de-configure
 	# $4 - file path for vhost0 interface
 	# $5 - mtu for vhost0
+	# $6 - performance profile script
 	cat juju-header
 	if [ -s "$3" ]; then
 		printf "\n%s\n" "auto $2"
@@ -67,6 +70,11 @@ configVRouter()
 			    post-up ifconfig vhost0 mtu $mtu
 			EOF
 	fi
+	if [ -z "$1" ] && [ -n "$6" ]; then
+		cat <<-EOF
+			    post-up $6
+			EOF
+	fi
 }
 
 configureInterfaces()
@@ -136,7 +144,7 @@ configureVRouter()
 	ifacedown $iface_down vhost0; sleep 5
 	configureInterfacesDir
 	configureInterfaces $iface_delete
-	configVRouter "$1" $iface_up $iface_cfg $TMP/vrouter.cfg "$mtu" \
+	configVRouter "$1" $iface_up $iface_cfg $TMP/vrouter.cfg "$mtu" "$perf" \
 	    > /etc/network/interfaces.d/vrouter.cfg
 	ifaceup $iface_up
 	if [ -z "$1" ]; then
@@ -261,6 +269,9 @@ while getopts $OPTS opt; do
 	$MTU)
 		mtu=$OPTARG
 		;;
+	$PERF)
+		perf=$OPTARG
+		;;
 	"?")
 		usageError "Unknown argument: $OPTARG"
 		;;
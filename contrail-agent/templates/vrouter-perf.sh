@@ -0,0 +1,54 @@
+#!/bin/sh
+###############################################################################
+# [ WARNING ]
+# Configuration file maintained by Juju. Local changes may be overwritten.
+###############################################################################
+
+# Performance profile of kernel vRouter's physical interface, it's run by
+# post-up of vhost0.
+
+IFACE=${1:-{{ interface }}}
+{%- if enabled %}
+
+tune()
+{
+	iface=$1
+	dev=/sys/class/net/$iface
+	[ -d $dev ] || return 0
+	ethtool -K $iface {{ offloads }} || true
+{%- if ring_size %}
+	ethtool -G $iface rx {{ ring_size }} tx {{ ring_size }} || true
+{%- else %}
+	# pre-set maximums are printed first
+	rx=$(ethtool -g $iface 2>/dev/null | awk '/^RX:/ {print $2; exit}')
+	tx=$(ethtool -g $iface 2>/dev/null | awk '/^TX:/ {print $2; exit}')
+	if [ -n "$rx" ] && [ -n "$tx" ]; then
+		ethtool -G $iface rx $rx tx $tx || true
+	fi
+{%- endif %}
+	for queue in $dev/queues/rx-*; do
+		[ -e $queue/rps_cpus ] && echo {{ rps_mask }} > $queue/rps_cpus 2>/dev/null
+	done
+	# tx queues and IRQs are spread over cores local to the NIC
+	set -- {{ core_masks }}
+	i=0
+	for queue in $dev/queues/tx-*; do
+		eval mask=\${$((i % $# + 1))}
+		[ -e $queue/xps_cpus ] && echo $mask > $queue/xps_cpus 2>/dev/null
+		i=$((i + 1))
+	done
+	i=0
+	for irq in $(ls $dev/device/msi_irqs 2>/dev/null); do
+		eval mask=\${$((i % $# + 1))}
+		echo $mask > /proc/irq/$irq/smp_affinity 2>/dev/null || true
+		i=$((i + 1))
+	done
+	return 0
+}
+
+for iface in $IFACE $(cat /sys/class/net/$IFACE/bonding/slaves 2>/dev/null); do
+	tune $iface
+done
+{%- endif %}
+exit 0
+
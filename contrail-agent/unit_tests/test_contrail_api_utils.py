@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "hooks"))
+
+import contrail_api_utils  # noqa: E402
+
+
+def _succeed(calls, name, delay=0):
+    def _func():
+        calls.append(name)
+        time.sleep(delay)
+    return _func
+
+
+def _fail(calls, name, delay=0):
+    def _func():
+        calls.append(name)
+        time.sleep(delay)
+        raise Exception(name + " failed")
+    return _func
+
+
+class TestRunFirstSuccessful(unittest.TestCase):
+
+    def test_first_is_used(self):
+        calls = list()
+        funcs = [_succeed(calls, "a"), _succeed(calls, "b")]
+        self.assertEqual(
+            contrail_api_utils.run_first_successful(funcs, 2, 5), (0, []))
+        self.assertEqual(calls, ["a"])
+
+    def test_failed_are_skipped_in_order(self):
+        calls = list()
+        funcs = [_fail(calls, "a"), _fail(calls, "b"), _succeed(calls, "c")]
+        index, failed = contrail_api_utils.run_first_successful(funcs, 1, 5)
+        self.assertEqual(index, 2)
+        self.assertEqual([i for i, _ in failed], [0, 1])
+        self.assertEqual(str(failed[0][1]), "a failed")
+        self.assertEqual(calls, ["a", "b", "c"])
+
+    def test_all_failed(self):
+        calls = list()
+        funcs = [_fail(calls, "a"), _fail(calls, "b")]
+        index, failed = contrail_api_utils.run_first_successful(funcs, 2, 5)
+        self.assertIsNone(index)
+        self.assertEqual(sorted(i for i, _ in failed), [0, 1])
+
+    def test_empty_list(self):
+        self.assertEqual(
+            contrail_api_utils.run_first_successful([], 2, 5), (None, []))
+
+    def test_slow_server_is_hedged(self):
+        calls = list()
+        funcs = [_succeed(calls, "slow", delay=2), _succeed(calls, "fast")]
+        started = time.time()
+        index, failed = contrail_api_utils.run_first_successful(
+            funcs, 2, 0.1)
+        self.assertEqual((index, failed), (1, []))
+        self.assertLess(time.time() - started, 1)
+
+    def test_hedge_waits_for_delay(self):
+        calls = list()
+        funcs = [_succeed(calls, "a", delay=0.3), _succeed(calls, "b")]
+        self.assertEqual(
+            contrail_api_utils.run_first_successful(funcs, 2, 5), (0, []))
+        self.assertEqual(calls, ["a"])
+
+    def test_concurrency_limit(self):
+        calls = list()
+        funcs = [_succeed(calls, "a", delay=0.3), _succeed(calls, "b")]
+        self.assertEqual(
+            contrail_api_utils.run_first_successful(funcs, 1, 0.05), (0, []))
+        self.assertEqual(calls, ["a"])
+
+
+def _closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestMain(unittest.TestCase):
+    """Request file is run as the reconciler runs it."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.addCleanup(setattr, sys, "argv", sys.argv)
+        self.addCleanup(setattr, sys, "stderr", sys.stderr)
+        sys.stderr = open(os.devnull, "w")
+        self.addCleanup(sys.stderr.close)
+
+    def _main(self, request):
+        path = os.path.join(self.dir, "request")
+        with open(path, "w") as f:
+            json.dump(request, f)
+        sys.argv = ["contrail_api_utils.py", path]
+        return contrail_api_utils.main()
+
+    def test_without_servers(self):
+        # last controller is gone, so nothing is done
+        request = {"servers": [],
+                   "calls": [["del_virtual_router", ["node"]]]}
+        self.assertEqual(self._main(request), 0)
+
+    def test_failed_servers_are_reported(self):
+        request = {"servers": ["127.0.0.1"], "port": _closed_port(),
+                   "calls": [["del_virtual_router", ["node"]]]}
+        self.assertEqual(self._main(request), 1)
+        self.assertEqual(
+            contrail_api_utils.read_result(
+                os.path.join(self.dir, "request")),
+            (None, ["127.0.0.1"]))
+
+    def test_result_is_absent(self):
+        self.assertEqual(
+            contrail_api_utils.read_result(os.path.join(self.dir, "none")),
+            (None, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "hooks"))
+
+import dpdk_utils  # noqa: E402
+
+
+class SysfsTestCase(unittest.TestCase):
+    """Runs functions against a fake sysfs tree in a temporary directory."""
+
+    def setUp(self):
+        self.sysfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sysfs)
+
+    def write(self, path, value):
+        path = os.path.join(self.sysfs, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(value + "\n")
+
+    def read(self, path):
+        with open(os.path.join(self.sysfs, path)) as f:
+            return f.read().strip()
+
+    def add_node(self, node, cpus, pages=0):
+        """Adds NUMA node, cpus are given as threads of physical cores."""
+        self.write("devices/system/node/node{}/cpulist".format(node),
+                   ",".join(str(cpu) for core in cpus for cpu in core))
+        for core in cpus:
+            for cpu in core:
+                self.write("devices/system/cpu/cpu{}/topology/"
+                           "thread_siblings_list".format(cpu),
+                           ",".join(str(sibling) for sibling in core))
+        self.write(self.pages_path(node), str(pages))
+
+    def pages_path(self, node):
+        return ("devices/system/node/node{}/hugepages/hugepages-2048kB/"
+                "nr_hugepages".format(node))
+
+    def two_nodes(self):
+        # 2 nodes with 4 physical cores each and 2 threads per core
+        self.write("devices/system/node/online", "0-1")
+        self.add_node(0, [(0, 8), (1, 9), (2, 10), (3, 11)], pages=512)
+        self.add_node(1, [(4, 12), (5, 13), (6, 14), (7, 15)], pages=512)
+
+
+class TestSelectCores(SysfsTestCase):
+
+    def test_core_0_and_its_sibling_are_skipped(self):
+        self.two_nodes()
+        self.assertEqual(dpdk_utils.select_cores(0, 2, self.sysfs), [1, 2])
+
+    def test_one_thread_of_each_core(self):
+        self.two_nodes()
+        self.assertEqual(dpdk_utils.select_cores(0, 10, self.sysfs),
+                         [1, 2, 3])
+
+    def test_cores_of_nic_node(self):
+        self.two_nodes()
+        self.assertEqual(dpdk_utils.select_cores(1, 3, self.sysfs),
+                         [4, 5, 6])
+
+    def test_without_hyperthreading(self):
+        self.add_node(0, [(0,), (1,), (2,)])
+        self.assertEqual(dpdk_utils.select_cores(0, 4, self.sysfs), [1, 2])
+
+    def test_kernel_without_numa(self):
+        self.write("devices/system/cpu/online", "0-3")
+        self.assertEqual(dpdk_utils.numa_nodes(self.sysfs), [0])
+        self.assertEqual(dpdk_utils.select_cores(0, 2, self.sysfs), [1, 2])
+
+
+class TestNumaNode(SysfsTestCase):
+
+    def test_pci_device(self):
+        self.write("bus/pci/devices/0000:81:00.0/numa_node", "1")
+        self.assertEqual(
+            dpdk_utils.pci_numa_node("0000:81:00.0", self.sysfs), 1)
+
+    def test_unknown_node(self):
+        self.write("class/net/eth0/device/numa_node", "-1")
+        self.assertEqual(dpdk_utils.iface_numa_node("eth0", self.sysfs), 0)
+        self.assertEqual(dpdk_utils.iface_numa_node("eth1", self.sysfs), 0)
+
+
+class TestHugepages(SysfsTestCase):
+
+    def test_nic_node_gets_min_pages(self):
+        self.assertEqual(dpdk_utils.hugepages_per_node(1024, 1, [0, 1], 768),
+                         {0: 256, 1: 768})
+
+    def test_even_split_is_enough(self):
+        self.assertEqual(dpdk_utils.hugepages_per_node(1024, 0, [0, 1], 256),
+                         {0: 512, 1: 512})
+
+    def test_not_enough_pages(self):
+        self.assertEqual(dpdk_utils.hugepages_per_node(512, 1, [0, 1], 1024),
+                         {0: 0, 1: 512})
+
+    def test_set_node_hugepages(self):
+        self.two_nodes()
+        dpdk_utils.set_node_hugepages({0: 256, 1: 768}, self.sysfs)
+        self.assertEqual(self.read(self.pages_path(0)), "256")
+        self.assertEqual(self.read(self.pages_path(1)), "768")
+        self.assertEqual(dpdk_utils.node_hugepages_memory(1, self.sysfs),
+                         1536)
+
+    def test_missing_node_is_skipped(self):
+        self.two_nodes()
+        dpdk_utils.set_node_hugepages({1: 768, 2: 128}, self.sysfs)
+        self.assertEqual(self.read(self.pages_path(1)), "768")
+        self.assertFalse(os.path.exists(
+            os.path.join(self.sysfs, self.pages_path(2))))
+
+    def test_boot_service_frees_pages_first(self):
+        self.two_nodes()
+        service = dpdk_utils.hugepages_service({0: 768, 1: 256}, self.sysfs)
+        commands = [line for line in service.splitlines()
+                    if line.startswith("ExecStart=")]
+        self.assertEqual(commands, [
+            "ExecStart=-/bin/sh -c 'echo 256 > {}'".format(
+                os.path.join(self.sysfs, self.pages_path(1))),
+            "ExecStart=-/bin/sh -c 'echo 768 > {}'".format(
+                os.path.join(self.sysfs, self.pages_path(0))),
+        ])
+
+    def test_boot_service_without_hugepages(self):
+        self.assertIsNone(dpdk_utils.hugepages_service({0: 512}, self.sysfs))
+
+
+class TestDpdkSizes(unittest.TestCase):
+
+    def test_mempool_fits(self):
+        sizes = dpdk_utils.dpdk_sizes(4, 4, 1500, 1024)
+        self.assertTrue(sizes["fits"])
+        self.assertEqual(sizes["vr_mempool_sz"], 32767)
+        self.assertEqual(sizes["dpdk_rxd_sz"], 1024)
+
+    def test_mempool_is_reduced(self):
+        sizes = dpdk_utils.dpdk_sizes(4, 4, 9000, 256)
+        self.assertFalse(sizes["fits"])
+        self.assertEqual(sizes["vr_mempool_sz"], 32767)
+
+    def test_mempool_does_not_fit(self):
+        sizes = dpdk_utils.dpdk_sizes(4, 4, 1500, 64)
+        self.assertFalse(sizes["fits"])
+        self.assertIsNone(sizes["vr_mempool_sz"])
+        self.assertIsNone(sizes["mempool_memory_mb"])
+
+    def test_no_hugepages(self):
+        sizes = dpdk_utils.dpdk_sizes(1, 1, 1500, 0)
+        self.assertIsNone(sizes["vr_mempool_sz"])
+
+
+if __name__ == "__main__":
+    unittest.main()
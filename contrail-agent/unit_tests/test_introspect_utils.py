@@ -0,0 +1,161 @@
+import os
+import socket
+import sys
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "hooks"))
+
+import introspect_utils  # noqa: E402
+
+
+def node_status(*processes):
+    """Returns NodeStatus UVE with (module, state, description) processes."""
+    items = "".join(
+        "<ProcessStatus>"
+        "<module_id type=\"string\">{}</module_id>"
+        "<instance_id type=\"string\">0</instance_id>"
+        "<state type=\"string\">{}</state>"
+        "<description type=\"string\">{}</description>"
+        "</ProcessStatus>".format(*process)
+        for process in processes)
+    return (
+        "<__NodeStatusUVE_list type=\"slist\">"
+        "<NodeStatusUVE type=\"sandesh\"><data type=\"struct\">"
+        "<NodeStatus><name type=\"string\">node</name>"
+        "<process_status type=\"list\">"
+        "<list type=\"struct\" size=\"{}\">{}</list>"
+        "</process_status></NodeStatus></data></NodeStatusUVE>"
+        "</__NodeStatusUVE_list>".format(len(processes), items))
+
+
+class TestParseNodeStatus(unittest.TestCase):
+
+    def test_functional(self):
+        data = node_status(("contrail-control", "Functional", ""))
+        self.assertEqual(
+            introspect_utils.parse_node_status(data, "contrail-control"),
+            ("active", ""))
+
+    def test_non_functional_with_reason(self):
+        data = node_status(("contrail-control", "Non-Functional",
+                            "Number of connections:4, Expected:5"))
+        self.assertEqual(
+            introspect_utils.parse_node_status(data, "contrail-control"),
+            ("initializing", "(Number of connections:4, Expected:5)"))
+
+    def test_non_functional_without_reason(self):
+        data = node_status(("contrail-api", "Non-Functional", ""))
+        self.assertEqual(
+            introspect_utils.parse_node_status(data, "contrail-api"),
+            ("initializing", ""))
+
+    def test_process_of_the_service_is_taken(self):
+        data = node_status(("contrail-dns", "Non-Functional", "down"),
+                           ("contrail-control", "Functional", ""))
+        self.assertEqual(
+            introspect_utils.parse_node_status(data, "contrail-control"),
+            ("active", ""))
+
+    def test_unknown_service(self):
+        data = node_status(("contrail-dns", "Functional", ""))
+        self.assertIsNone(
+            introspect_utils.parse_node_status(data, "contrail-control"))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        status, body = self.server.reply
+        data = body.encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def _closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestProbeServices(unittest.TestCase):
+    """Services are probed at a fake introspect server."""
+
+    def setUp(self):
+        reply = (200, node_status(
+            ("contrail-control", "Functional", ""),
+            ("contrail-api", "Non-Functional", "Keystone connection down")))
+        # each service has its own port like real ones
+        self.server = self._server(reply)
+        ports = {"contrail-control": self.server.server_address[1],
+                 "contrail-api": self._server(reply).server_address[1],
+                 "contrail-collector": _closed_port()}
+        self._patch(introspect_utils, "INTROSPECT_PORTS", ports)
+        self._patch(introspect_utils, "SERVICE_PORTS", dict())
+        self._patch(introspect_utils, "_connections", dict())
+
+    def _server(self, reply):
+        server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), _Handler)
+        server.reply = reply
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def _patch(self, obj, name, value):
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)
+
+    def test_statuses(self):
+        self.assertEqual(
+            introspect_utils.probe_services(
+                ["contrail-control", "contrail-api"]),
+            {"contrail-control": ("active", ""),
+             "contrail-api": ("initializing",
+                              "(Keystone connection down)")})
+
+    def test_connection_is_kept(self):
+        introspect_utils.probe_services(["contrail-control"])
+        introspect_utils.probe_services(["contrail-control"])
+        self.assertEqual(len(introspect_utils._connections), 1)
+
+    def test_unreachable_service(self):
+        self.assertIsNone(introspect_utils.probe_services(
+            ["contrail-control", "contrail-collector"]))
+
+    def test_service_without_introspect(self):
+        self.assertIsNone(introspect_utils.probe_services(
+            ["contrail-control", "contrail-schema"]))
+
+    def test_error_of_introspect(self):
+        self.server.reply = (500, "")
+        self.assertIsNone(introspect_utils.probe_services(
+            ["contrail-control"]))
+
+    def test_service_absent_in_node_status(self):
+        self.server.reply = (200, node_status(
+            ("contrail-dns", "Functional", "")))
+        self.assertIsNone(introspect_utils.probe_services(
+            ["contrail-control"]))
+
+    def test_port_of_service(self):
+        introspect_utils.SERVICE_PORTS["contrail-webui"] = (
+            self.server.server_address[1])
+        self.assertEqual(
+            introspect_utils.probe_services(["contrail-webui"]),
+            {"contrail-webui": ("active", "")})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,14 +7,13 @@ from charmhelpers.core.hookenv import (
     UnregisteredHookError,
     config,
     log,
-    relation_get,
     relation_ids,
     related_units,
     status_set,
-    relation_set,
     local_unit,
     open_port,
     close_port,
+    is_leader,
 )
 
 from charmhelpers.fetch import (
@@ -30,6 +29,8 @@ from contrail_analytics_utils import (
 from common_utils import (
     get_ip,
     fix_hostname,
+    upgrade_container,
+    update_apply_slots,
 )
 from docker_utils import (
     add_docker_repo,
@@ -38,6 +39,8 @@ from docker_utils import (
     DOCKER_PACKAGES,
     is_container_launched,
 )
+from hook_profiler import hook_profiling
+from relation_utils import relation_get, relation_set, relation_set_many
 
 
 PACKAGES = []
@@ -73,9 +76,8 @@ def config_changed():
         settings = {'private-address': get_ip()}
         rnames = ("contrail-analytics", "contrail-analyticsdb",
                   "analytics-cluster", "http-services")
-        for rname in rnames:
-            for rid in relation_ids(rname):
-                relation_set(relation_id=rid, relation_settings=settings)
+        relation_set_many((rid, settings) for rname in rnames
+                          for rid in relation_ids(rname))
 
     if config.changed("docker-registry"):
         apply_docker_insecure()
@@ -181,6 +183,19 @@ def analytics_cluster_joined():
     update_charm_status()
 
 
+@hooks.hook("analytics-cluster-relation-changed",
+            "analytics-cluster-relation-departed")
+def analytics_cluster_changed():
+    # peers report progress of rolling apply of configuration
+    if is_leader():
+        update_apply_slots()
+
+
+@hooks.hook("leader-settings-changed")
+def leader_settings_changed():
+    update_charm_status()
+
+
 @hooks.hook("update-status")
 def update_status():
     update_charm_status(update_config=False)
@@ -188,14 +203,16 @@ def update_status():
 
 @hooks.hook("upgrade-charm")
 def upgrade_charm():
-    # NOTE: image can not be deleted if container is running.
-    # TODO: so think about killing the container
-
     # clear cached version of image
     config.pop("version_with_build", None)
     config.pop("version", None)
     config.save()
 
+    # new image is loaded while the old container is running, then
+    # containers are swapped
+    if upgrade_container(CONTAINER_NAME, update_charm_status):
+        return
+
     # NOTE: this hook can be fired when either resource changed or charm code
     # changed. so if code was changed then we may need to update config
     update_charm_status()
@@ -233,7 +250,8 @@ def http_services_joined(rel_id=None):
 
 def main():
     try:
-        hooks.execute(sys.argv)
+        with hook_profiling():
+            hooks.execute(sys.argv)
     except UnregisteredHookError as e:
         log("Unknown hook {} - skipping.".format(e))
 
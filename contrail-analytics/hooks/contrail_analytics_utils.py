@@ -6,19 +6,21 @@ import apt_pkg
 from charmhelpers.core.hookenv import (
     config,
     related_units,
-    relation_get,
     relation_ids,
+    relations_of_type,
     status_set,
     log,
 )
 
 from common_utils import (
+    CONFIG_DIR,
     get_ip,
     check_run_prerequisites,
     run_container,
     json_loads,
     render_and_check,
 )
+from relation_utils import relation_get
 
 apt_pkg.init()
 config = config()
@@ -37,12 +39,9 @@ def controller_ctx():
         return {}
 
     controller_ip_list = []
-    for rid in relation_ids("contrail-analytics"):
-        for unit in related_units(rid):
-            utype = relation_get('unit-type', unit, rid)
-            if utype == "controller":
-                ip = relation_get("private-address", unit, rid)
-                controller_ip_list.append(ip)
+    for data in relations_of_type("contrail-analytics"):
+        if data.get("unit-type") == "controller":
+            controller_ip_list.append(data.get("private-address"))
     sort_key = lambda ip: struct.unpack("!L", inet_aton(ip))[0]
     controller_ip_list = sorted(controller_ip_list, key=sort_key)
     return {
@@ -102,12 +101,13 @@ def get_context():
     return ctx
 
 
-def render_config(ctx=None, do_check=True):
+def render_config(ctx=None):
     if not ctx:
         ctx = get_context()
 
-    return render_and_check(
-        ctx, "analytics.conf", "/etc/contrailctl/analytics.conf", do_check)
+    changed = render_and_check(
+        ctx, "analytics.conf", CONFIG_DIR + "/analytics.conf")
+    return bool(changed)
 
 
 def update_charm_status(update_config=True):
@@ -150,5 +150,5 @@ def update_charm_status(update_config=True):
         return
     # TODO: what should happens if relation departed?
 
-    render_config(ctx, do_check=False)
+    render_config(ctx)
     run_container(CONTAINER_NAME, ctx.get("cloud_orchestrator"))
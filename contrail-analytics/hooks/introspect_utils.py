@@ -0,0 +1,145 @@
+import socket
+import ssl
+import threading
+from xml.etree import ElementTree
+
+from six.moves import http_client
+
+from charmhelpers.core.hookenv import log
+
+
+# introspect HTTP servers of contrail services
+INTROSPECT_PORTS = {
+    "contrail-control": 8083,
+    "contrail-api": 8084,
+    "contrail-vrouter-agent": 8085,
+    "contrail-collector": 8089,
+    "contrail-analytics-api": 8090,
+}
+# services without introspect are checked by their listening port
+SERVICE_PORTS = {
+    "contrail-webui": 8143,
+    "contrail-database": 9042,
+}
+NODE_STATUS_URL = "/Snh_SandeshUVECacheReq?x=NodeStatus"
+PROBE_TIMEOUT = 3
+
+_connections = dict()
+
+
+def _ssl_context(certs):
+    context = ssl.create_default_context(cafile=certs["cafile"])
+    # introspect certificates are issued for host names and IPs of the node
+    context.check_hostname = False
+    context.load_cert_chain(certs["certfile"], certs["keyfile"])
+    return context
+
+
+def _connection(host, port, certs):
+    # connections are kept for all probes of the hook
+    key = (host, port, bool(certs))
+    conn = _connections.get(key)
+    if conn is None:
+        if certs:
+            conn = http_client.HTTPSConnection(
+                host, port, timeout=PROBE_TIMEOUT,
+                context=_ssl_context(certs))
+        else:
+            conn = http_client.HTTPConnection(
+                host, port, timeout=PROBE_TIMEOUT)
+        _connections[key] = conn
+    return conn
+
+
+def http_request(conn, method, path, body=None, headers=None):
+    """Makes request over kept connection. Returns response and its body.
+
+    Server could close kept connection, so it's reconnected once.
+    """
+    for attempt in range(2):
+        try:
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            return response, response.read()
+        except (http_client.HTTPException, socket.error):
+            conn.close()
+            if attempt:
+                raise
+
+
+def _get_node_status(host, port, certs):
+    conn = _connection(host, port, certs)
+    response, body = http_request(conn, "GET", NODE_STATUS_URL)
+    if response.status != 200:
+        raise http_client.HTTPException("Introspect returns {} {}".format(
+            response.status, response.reason))
+    return body
+
+
+def parse_node_status(data, service):
+    """Returns (state, reason) of the service from NodeStatus UVE.
+
+    State and reason are the same as contrail-status reports them:
+    'active' for functional service, 'initializing' with description of
+    the problem in parentheses otherwise.
+    """
+    root = ElementTree.fromstring(data)
+    for process in root.iter("ProcessStatus"):
+        module = process.findtext("module_id")
+        if module and module != service:
+            continue
+        state = process.findtext("state")
+        if state == "Functional":
+            return "active", ""
+        description = process.findtext("description")
+        reason = "({})".format(description) if description else ""
+        return "initializing", reason
+    return None
+
+
+def _probe_port(host, port):
+    try:
+        sock = socket.create_connection((host, port), timeout=PROBE_TIMEOUT)
+    except socket.error as e:
+        log("Port {}:{} is not reachable: {}".format(host, port, e))
+        return None
+    sock.close()
+    return "active", ""
+
+
+def probe_service(service, host, certs=None):
+    """Returns (state, reason) of the service or None if it's unknown."""
+    if service in SERVICE_PORTS:
+        return _probe_port(host, SERVICE_PORTS[service])
+    port = INTROSPECT_PORTS.get(service)
+    if not port:
+        return None
+    try:
+        return parse_node_status(_get_node_status(host, port, certs), service)
+    except Exception as e:
+        log("Introspect of {} at {}:{} failed: {}".format(
+            service, host, port, e))
+        return None
+
+
+def probe_services(services, host="127.0.0.1", certs=None):
+    """Probes services concurrently by their introspect HTTP servers.
+
+    Returns dict of service name to (state, reason) tuple, or None if state
+    of any service can't be get from introspect, so caller can fall back to
+    contrail-status.
+    """
+    statuses = dict()
+
+    def _probe(service):
+        statuses[service] = probe_service(service, host, certs)
+
+    threads = [threading.Thread(target=_probe, args=(service,))
+               for service in services]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if any(statuses.get(service) is None for service in services):
+        return None
+    return statuses
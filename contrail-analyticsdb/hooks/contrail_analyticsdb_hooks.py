@@ -8,11 +8,9 @@ from charmhelpers.core.hookenv import (
     UnregisteredHookError,
     config,
     log,
-    relation_get,
     related_units,
     relation_ids,
     status_set,
-    relation_set,
     leader_set,
     leader_get,
     is_leader,
@@ -32,6 +30,8 @@ from contrail_analyticsdb_utils import (
 from common_utils import (
     get_ip,
     fix_hostname,
+    upgrade_container,
+    update_apply_slots,
 )
 from docker_utils import (
     add_docker_repo,
@@ -40,6 +40,8 @@ from docker_utils import (
     DOCKER_PACKAGES,
     is_container_launched,
 )
+from hook_profiler import hook_profiling
+from relation_utils import relation_get, relation_set, relation_set_many
 
 
 PACKAGES = []
@@ -87,9 +89,8 @@ def config_changed():
     if config.changed("control-network"):
         settings = {'private-address': get_ip()}
         rnames = ("contrail-analyticsdb", "analyticsdb-cluster")
-        for rname in rnames:
-            for rid in relation_ids(rname):
-                relation_set(relation_id=rid, relation_settings=settings)
+        relation_set_many((rid, settings) for rname in rnames
+                          for rid in relation_ids(rname))
 
     if config.changed("docker-registry"):
         apply_docker_insecure()
@@ -114,8 +115,8 @@ def _update_relation(rid=None):
         relation_set(relation_id=rid, relation_settings=settings)
         return
 
-    for rid in relation_ids("contrail-analyticsdb"):
-        relation_set(relation_id=rid, relation_settings=settings)
+    relation_set_many((rid, settings)
+                      for rid in relation_ids("contrail-analyticsdb"))
 
 
 @hooks.hook("contrail-analyticsdb-relation-joined")
@@ -176,6 +177,14 @@ def analyticsdb_cluster_joined():
     relation_set(relation_settings=settings)
 
 
+@hooks.hook("analyticsdb-cluster-relation-changed",
+            "analyticsdb-cluster-relation-departed")
+def analyticsdb_cluster_changed():
+    # peers report progress of rolling apply of configuration
+    if is_leader():
+        update_apply_slots()
+
+
 @hooks.hook("update-status")
 def update_status():
     update_charm_status(update_config=False)
@@ -183,14 +192,16 @@ def update_status():
 
 @hooks.hook("upgrade-charm")
 def upgrade_charm():
-    # NOTE: image can not be deleted if container is running.
-    # TODO: so think about killing the container
-
     # clear cached version of image
     config.pop("version_with_build", None)
     config.pop("version", None)
     config.save()
 
+    # new image is loaded while the old container is running, then
+    # containers are swapped
+    if upgrade_container(CONTAINER_NAME, update_charm_status):
+        return
+
     # NOTE: this hook can be fired when either resource changed or charm code
     # changed. so if code was changed then we may need to update config
     update_charm_status()
@@ -198,7 +209,8 @@ def upgrade_charm():
 
 def main():
     try:
-        hooks.execute(sys.argv)
+        with hook_profiling():
+            hooks.execute(sys.argv)
     except UnregisteredHookError as e:
         log("Unknown hook {} - skipping.".format(e))
 
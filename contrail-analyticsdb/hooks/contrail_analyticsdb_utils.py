@@ -6,20 +6,22 @@ import apt_pkg
 from charmhelpers.core.hookenv import (
     config,
     related_units,
-    relation_get,
     relation_ids,
+    relations_of_type,
     status_set,
     leader_get,
     log,
 )
 
 from common_utils import (
+    CONFIG_DIR,
     get_ip,
     check_run_prerequisites,
     run_container,
     json_loads,
     render_and_check,
 )
+from relation_utils import relation_get
 
 
 apt_pkg.init()
@@ -34,14 +36,13 @@ SERVICES_TO_CHECK = ["contrail-database"]
 def servers_ctx():
     controller_ip_list = []
     analytics_ip_list = []
-    for rid in relation_ids("contrail-analyticsdb"):
-        for unit in related_units(rid):
-            utype = relation_get("unit-type", unit, rid)
-            ip = relation_get("private-address", unit, rid)
-            if utype == "controller":
-                controller_ip_list.append(ip)
-            if utype == "analytics":
-                analytics_ip_list.append(ip)
+    for data in relations_of_type("contrail-analyticsdb"):
+        utype = data.get("unit-type")
+        ip = data.get("private-address")
+        if utype == "controller":
+            controller_ip_list.append(ip)
+        if utype == "analytics":
+            analytics_ip_list.append(ip)
 
     sort_key = lambda ip: struct.unpack("!L", inet_aton(ip))[0]
     controller_ip_list = sorted(controller_ip_list, key=sort_key)
@@ -82,12 +83,13 @@ def get_context():
     return ctx
 
 
-def render_config(ctx=None, do_check=True):
+def render_config(ctx=None):
     if not ctx:
         ctx = get_context()
 
-    return render_and_check(ctx, "analyticsdb.conf",
-                            "/etc/contrailctl/analyticsdb.conf", do_check)
+    changed = render_and_check(
+        ctx, "analyticsdb.conf", CONFIG_DIR + "/analyticsdb.conf")
+    return bool(changed)
 
 
 def update_charm_status(update_config=True):
@@ -121,5 +123,5 @@ def update_charm_status(update_config=True):
         return
     # TODO: what should happens if relation departed?
 
-    render_config(ctx, do_check=False)
+    render_config(ctx)
     run_container(CONTAINER_NAME, ctx.get("cloud_orchestrator"))
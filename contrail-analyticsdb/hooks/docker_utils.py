@@ -1,17 +1,28 @@
 import json
 import functools
+import os
 import platform
+import shlex
+import socket
+import tarfile
+from collections import namedtuple
 from time import sleep, time
 
 from subprocess import (
     CalledProcessError,
+    STDOUT,
     check_call,
     check_output
 )
+from six.moves import http_client
+from six.moves.urllib.parse import quote, urlencode
+
 from charmhelpers.core.hookenv import (
+    atexit,
     resource_get,
     config,
     log,
+    status_set,
     ERROR,
     WARNING,
 )
@@ -23,9 +34,16 @@ config = config()
 
 DOCKER_PACKAGES = ["docker.engine"]
 DOCKER_CLI = "/usr/bin/docker"
+DOCKER_SOCKET = "/var/run/docker.sock"
+# vendor domains of labels of images built by contrail-container-builder
+CONTRAIL_LABEL_DOMAINS = ["net.juniper.contrail", "io.tungsten"]
+
+ContainerState = namedtuple("ContainerState",
+                            ["present", "running", "status", "image"])
+ExecResult = namedtuple("ExecResult", ["exit_code", "output"])
 
 
-def retry(f=None, timeout=10, delay=2):
+def retry(f=None, timeout=10, delay=2, backoff=1, max_delay=None):
     """Retry decorator.
 
     Provides a decorator that can be used to retry a function if it raises
@@ -33,6 +51,8 @@ def retry(f=None, timeout=10, delay=2):
 
     :param timeout: timeout in seconds (default 10)
     :param delay: retry delay in seconds (default 2)
+    :param backoff: multiplier of delay after each retry (default 1)
+    :param max_delay: upper limit of growing delay (default no limit)
 
     Examples::
 
@@ -47,12 +67,14 @@ def retry(f=None, timeout=10, delay=2):
             # fetch url
     """
     if not f:
-        return functools.partial(retry, timeout=timeout, delay=delay)
+        return functools.partial(retry, timeout=timeout, delay=delay,
+                                 backoff=backoff, max_delay=max_delay)
 
     @functools.wraps(f)
     def func(*args, **kwargs):
         start = time()
         error = None
+        current_delay = delay
         while True:
             try:
                 return f(*args, **kwargs)
@@ -62,10 +84,251 @@ def retry(f=None, timeout=10, delay=2):
             if elapsed >= timeout:
                 raise error
             remaining = timeout - elapsed
-            sleep(delay if delay <= remaining else remaining)
+            sleep(min(current_delay, remaining))
+            current_delay *= backoff
+            if max_delay is not None:
+                current_delay = min(current_delay, max_delay)
     return func
 
 
+def wait_until(predicate, timeout=30, delay=0.5, backoff=2, max_delay=5):
+    """Waits until predicate returns true value.
+
+    Predicate is polled with exponentially growing delay between calls,
+    so the caller goes on as soon as the condition is met.
+
+    :param timeout: deadline in seconds (default 30)
+    :param delay: first delay between calls in seconds (default 0.5)
+    :param backoff: multiplier of delay after each call (default 2)
+    :param max_delay: upper limit of growing delay (default 5)
+    :returns: the last value returned by predicate, so it is false if
+        deadline has been reached
+    """
+    deadline = time() + timeout
+    while True:
+        result = predicate()
+        if result:
+            return result
+        remaining = deadline - time()
+        if remaining <= 0:
+            log("Condition was not met in {} seconds".format(timeout))
+            return result
+        sleep(min(delay, remaining))
+        delay = min(delay * backoff, max_delay)
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status, message):
+        super(DockerAPIError, self).__init__(
+            "Docker API error {}: {}".format(status, message))
+        self.status = status
+        self.message = message
+
+
+class _UnixHTTPConnection(http_client.HTTPConnection):
+    """HTTP connection over docker's unix socket."""
+
+    def __init__(self, path):
+        # NOTE: no timeout like for docker CLI - image load can be long
+        http_client.HTTPConnection.__init__(self, "localhost", timeout=None)
+        self._socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._socket_path)
+        self.sock = sock
+
+
+class DockerClient(object):
+    """Minimal Docker Engine API client.
+
+    Keeps one connection to the docker daemon open and reuses it for all
+    requests made during the hook.
+    """
+
+    def __init__(self, path=DOCKER_SOCKET):
+        self._conn = _UnixHTTPConnection(path)
+
+    def close(self):
+        self._conn.close()
+
+    def _request(self, method, url, body=None, headers=None, close=False):
+        headers = dict(headers or {})
+        if isinstance(body, dict):
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        # GET requests are safe to repeat if daemon closed idle connection
+        attempts = 2 if method == "GET" else 1
+        while True:
+            attempts -= 1
+            try:
+                self._conn.request(method, url, body, headers)
+                response = self._conn.getresponse()
+                data = response.read()
+                break
+            except (socket.error, http_client.HTTPException):
+                self._conn.close()
+                if attempts <= 0:
+                    raise
+        if close:
+            # connection was hijacked by the daemon and can't be reused
+            self._conn.close()
+        if response.status >= 400:
+            try:
+                message = json.loads(data.decode("UTF-8"))["message"]
+            except Exception:
+                message = data
+            raise DockerAPIError(response.status, message)
+        return data
+
+    def _json(self, method, url, body=None):
+        data = self._request(method, url, body)
+        return json.loads(data.decode("UTF-8")) if data else None
+
+    def inspect(self, name):
+        """Returns container's description or None if it is absent."""
+        try:
+            return self._json("GET", "/containers/{}/json".format(quote(name)))
+        except DockerAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def inspect_image(self, image):
+        """Returns image's description or None if it is absent."""
+        try:
+            return self._json("GET", "/images/{}/json".format(quote(image)))
+        except DockerAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def state(self, name):
+        info = self.inspect(name)
+        if info is None:
+            return ContainerState(False, False, None, None)
+        state = info.get("State", {})
+        return ContainerState(True, bool(state.get("Running")),
+                              state.get("Status"), info.get("Image"))
+
+    def exec_run(self, name, cmd):
+        exec_config = {"AttachStdout": True, "AttachStderr": True,
+                       "Tty": False, "Cmd": cmd}
+        exec_id = self._json(
+            "POST", "/containers/{}/exec".format(quote(name)),
+            exec_config)["Id"]
+        data = self._request(
+            "POST", "/exec/{}/start".format(exec_id),
+            json.dumps({"Detach": False, "Tty": False}),
+            {"Content-Type": "application/json"}, close=True)
+        info = self._json("GET", "/exec/{}/json".format(exec_id))
+        return ExecResult(info.get("ExitCode"), _demux_stdout(data))
+
+    def load(self, path, progress=None):
+        """Loads image from tarball and returns list of loaded references.
+
+        Tarball is streamed to the daemon, progress is called with percent
+        of sent data.
+        """
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            headers = {"Content-Type": "application/x-tar",
+                       "Content-Length": str(size)}
+            body = _ProgressReader(f, size, progress) if progress else f
+            data = self._request("POST", "/images/load?quiet=1", body,
+                                 headers)
+        loaded = list()
+        for line in data.decode("UTF-8").splitlines():
+            if not line.strip():
+                continue
+            msg = json.loads(line)
+            if "error" in msg:
+                raise DockerAPIError(500, msg["error"])
+            stream = msg.get("stream", "").strip()
+            for prefix in ("Loaded image ID:", "Loaded image:"):
+                if stream.startswith(prefix):
+                    loaded.append(stream[len(prefix):].strip())
+                    break
+        return loaded
+
+    def tag(self, image, repo, tag):
+        query = urlencode({"repo": repo, "tag": tag})
+        self._request("POST", "/images/{}/tag?{}".format(quote(image), query))
+
+    def remove(self, name, timeout=10):
+        """Stops container gracefully and removes it."""
+        try:
+            self._request("POST", "/containers/{}/stop?t={}".format(
+                quote(name), timeout))
+        except DockerAPIError as e:
+            # 304 means that container is already stopped
+            if e.status != 304:
+                raise
+        self._request("DELETE", "/containers/{}".format(quote(name)))
+
+
+class _ProgressReader(object):
+    """File wrapper that reports progress of reading each 10 percents."""
+
+    def __init__(self, f, size, progress):
+        self._f = f
+        self._size = size or 1
+        self._progress = progress
+        self._read = 0
+        self._reported = 0
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._read += len(data)
+        percent = self._read * 100 // self._size
+        if percent >= self._reported + 10:
+            self._reported = percent - percent % 10
+            self._progress(self._reported)
+        return data
+
+
+def _demux_stdout(data):
+    # exec without tty returns multiplexed stream: 8 bytes header with
+    # stream type and big-endian size followed by payload
+    output = bytearray()
+    pos = 0
+    while pos + 8 <= len(data):
+        header = bytearray(data[pos:pos + 8])
+        size = (header[4] << 24) | (header[5] << 16) | (header[6] << 8) \
+            | header[7]
+        if header[0] == 1:
+            output.extend(data[pos + 8:pos + 8 + size])
+        pos += 8 + size
+    return bytes(output).decode("UTF-8")
+
+
+_client = None
+
+
+def docker_client():
+    """Returns client shared by the whole hook or None if API is absent."""
+    global _client
+    if _client is None:
+        if not os.path.exists(DOCKER_SOCKET):
+            return None
+        _client = DockerClient()
+        atexit(_client.close)
+    return _client
+
+
+def _api_call(method, *args):
+    """Calls client's method. Returns (False, None) if CLI must be used."""
+    client = docker_client()
+    if not client:
+        return False, None
+    try:
+        return True, getattr(client, method)(*args)
+    except (socket.error, http_client.HTTPException, DockerAPIError) as e:
+        log("Docker API call failed, fallback to CLI: {}".format(e),
+            level=WARNING)
+    return False, None
+
+
 # NOTE: this code assumes that name of container is the part of the
 # name of docker image
 
@@ -120,53 +383,171 @@ def docker_login():
         check_call([DOCKER_CLI, "login", "-u", login, "-p", password, docker_registry])
 
 
-def is_container_launched(name):
-    # NOTE: 'paused' state is not getting into account if someone paused it
-    # NOTE: assume that this cmd is the same as inspect of state:
-    # [DOCKER_CLI, "inspect", "-f", "{{.State.Running}}", name]
-    cmd = DOCKER_CLI + ' ps | grep -w ' + name
+def get_container_state(name):
+    ok, state = _api_call("state", name)
+    if ok:
+        return state
     try:
-        check_output(cmd, shell=True)
-        return True
+        output = check_output([DOCKER_CLI, "inspect", "--type", "container",
+            "-f", "{{.State.Running}} {{.State.Status}} {{.Image}}", name])
     except CalledProcessError:
-        return False
+        return ContainerState(False, False, None, None)
+    running, status, image = output.decode("UTF-8").split()
+    return ContainerState(True, running == "true", status, image)
+
+
+def is_container_launched(name):
+    # NOTE: 'paused' state is not getting into account if someone paused it
+    return get_container_state(name).running
 
 
 def is_container_present(name):
-    cmd = DOCKER_CLI + ' ps --all | grep -w ' + name
+    return get_container_state(name).present
+
+
+def inspect_image(image):
+    ok, info = _api_call("inspect_image", image)
+    if ok:
+        return info
     try:
-        check_output(cmd, shell=True)
-        return True
+        output = check_output([DOCKER_CLI, "inspect", "--type", "image",
+                               image])
     except CalledProcessError:
-        return False
+        return None
+    return json.loads(output.decode("UTF-8"))[0]
+
+
+def _version_from_labels(info):
+    labels = (info.get("Config") or {}).get("Labels") or {}
+    for domain in CONTRAIL_LABEL_DOMAINS:
+        if labels.get(domain + ".version"):
+            return labels[domain + ".version"]
+    # generic 'version' can be inherited from the base image. it's used only
+    # in contrail images, they set it to version of contrail and have
+    # '<domain>.container.name' label
+    for domain in CONTRAIL_LABEL_DOMAINS:
+        if domain + ".container.name" in labels:
+            return labels.get("version") or None
+    return None
 
 
 def get_contrail_version(pkg="python-contrail"):
     image_name = config.get("image-name")
     image_tag = config.get("image-tag")
     image_id = "{}:{}".format(image_name, image_tag)
-    return check_output([DOCKER_CLI,
-        "run", "--rm", "--entrypoint", "dpkg-query",
-        image_id, "-f", "${Version}", "-W", pkg]).rstrip()
+    info = inspect_image(image_id)
+    if not info:
+        raise Exception("Image {} is absent".format(image_id))
+
+    # image can't be changed while it has the same ID. so cache version
+    # to avoid running of throwaway container for each upgrade.
+    versions = json.loads(config.get("image-versions", "{}"))
+    version = versions.get(info["Id"])
+    if version:
+        return version
+
+    version = _version_from_labels(info)
+    if not version:
+        log("Image {} has no version labels. Run it to get version of {}"
+            .format(image_id, pkg))
+        version = check_output([DOCKER_CLI,
+            "run", "--rm", "--entrypoint", "dpkg-query",
+            info["Id"], "-f", "${Version}", "-W", pkg]).decode(
+                "UTF-8").rstrip()
+    # versions of removed images are dropped, so it doesn't grow with
+    # each upgrade
+    versions = dict((image, value) for image, value in versions.items()
+                    if inspect_image(image))
+    versions[info["Id"]] = version
+    config["image-versions"] = json.dumps(versions)
+    config.save()
+    return version
+
+
+def _image_manifest(path):
+    """Returns ID and tags of the image in tarball made by 'docker save'.
+
+    They are read from manifest.json of the tarball, image ID is the
+    digest of image's config. Returns (None, []) if there is no manifest.
+    """
+    try:
+        with tarfile.open(path) as tar:
+            f = tar.extractfile("manifest.json")
+            manifest = json.loads(f.read().decode("UTF-8"))
+    except (tarfile.TarError, KeyError, ValueError, IOError) as e:
+        log("Manifest of image {} can't be read: {}".format(path, e),
+            level=WARNING)
+        return None, []
+    if not manifest:
+        return None, []
+    # config is "<digest>.json" or "blobs/sha256/<digest>" in newer docker
+    digest = os.path.basename(manifest[0]["Config"]).split(".")[0]
+    return "sha256:" + digest, manifest[0].get("RepoTags") or []
+
+
+def _load_progress(percent):
+    status_set("maintenance", "Loading image: {}%".format(percent))
 
 
 def load_docker_image(name):
     img_path = resource_get(name)
     if not img_path:
         return None, None
-    output = check_output([DOCKER_CLI, "load", "-q", "-i", img_path])
-    if "sha256:" not in output:
-        # suppose that file has name/tag inside. just eval it from output
-        res = output.rstrip().split(' ')[2].split(":")
+    image_id, tags = _image_manifest(img_path)
+    if image_id and inspect_image(image_id):
+        # several GB of tarball are not imported again
+        log("Image {} from resource is already loaded".format(image_id))
+        loaded = [image_id]
+        for ref in tags:
+            tag_image(image_id, ref)
+            loaded = [ref]
+    else:
+        ok, loaded = _api_call("load", img_path, _load_progress)
+        if not ok:
+            output = check_output([DOCKER_CLI, "load", "-q", "-i", img_path])
+            loaded = [output.rstrip().split(' ')[2]]
+    if not loaded:
+        return None, None
+    if not loaded[0].startswith("sha256:"):
+        # suppose that file has name/tag inside. just use it
+        res = loaded[0].rsplit(":", 1)
         return res[0], res[1]
 
-    sha = output.rstrip().split(' ')[2].split(":")[1]
+    sha = loaded[0].split(":")[1]
     # name can be sha[0:12] but looks like that resource name can be used
     tag = "latest"
-    check_call([DOCKER_CLI, "tag", sha, "{}:{}".format(name, tag)])
+    ok, _ = _api_call("tag", sha, name, tag)
+    if not ok:
+        check_call([DOCKER_CLI, "tag", sha, "{}:{}".format(name, tag)])
     return name, tag
 
 
+def tag_image(image, ref):
+    """Points reference 'name:tag' to the image."""
+    repo, tag = ref.rsplit(":", 1)
+    ok, _ = _api_call("tag", image, repo, tag)
+    if not ok:
+        check_call([DOCKER_CLI, "tag", image, ref])
+
+
+def pull_docker_image(image):
+    """Pulls image from registry. Returns False if it can't be pulled."""
+    try:
+        check_output([DOCKER_CLI, "pull", image], stderr=STDOUT)
+    except CalledProcessError as e:
+        log("Image {} can't be pulled: {}".format(image, e.output),
+            level=WARNING)
+        return False
+    return True
+
+
+def remove_container(name):
+    ok, _ = _api_call("remove", name)
+    if not ok:
+        check_call([DOCKER_CLI, "stop", name])
+        check_call([DOCKER_CLI, "rm", name])
+
+
 def launch_docker_image(name, additional_args=[]):
     image_name = config.get("image-name")
     image_tag = config.get("image-tag")
@@ -194,24 +575,26 @@ def docker_cp(name, src, dst):
 
 
 def docker_exec(name, cmd, shell=False):
-    cli = [DOCKER_CLI, "exec", name]
-    if isinstance(cmd, list):
-        cli.extend(cmd)
-    else:
-        cli.append(cmd)
+    cmd = list(cmd) if isinstance(cmd, list) else [cmd]
     if shell:
-        output = check_output(' '.join(cli), shell=True)
-    else:
-        output = check_output(cli)
+        # command line was parsed by shell before
+        cmd = shlex.split(' '.join(cmd))
+    ok, result = _api_call("exec_run", name, cmd)
+    if ok:
+        if result.exit_code != 0:
+            raise CalledProcessError(result.exit_code, cmd, result.output)
+        return result.output
+
+    output = check_output([DOCKER_CLI, "exec", name] + cmd)
     return output.decode('UTF-8')
 
 
-@retry(timeout=32, delay=10)
+@retry(timeout=32, delay=1, backoff=2, max_delay=8)
 def apply_config_in_container(name, cfg_name):
     try:
-        cmd = (DOCKER_CLI + ' exec ' + name + ' contrailctl config sync -v'
-               + ' -c ' + cfg_name)
-        check_call(cmd, shell=True)
+        output = docker_exec(name, ["contrailctl", "config", "sync", "-v",
+                                    "-c", cfg_name])
+        log(output)
         return True
     except CalledProcessError as e:
         if e.returncode == 137:
@@ -0,0 +1,101 @@
+"""Relation data access with fewer hook tool calls.
+
+charmhelpers.core.hookenv.relation_get runs relation-get for each attribute
+even if other attributes of the unit were already read. Here the whole
+relation data of the unit is read once per hook and attributes are served
+from it. relation_set there runs 'relation-set --help' before each write,
+here support of --file is checked once per process. charmhelpers is synced
+from upstream, so this lives in the charm.
+"""
+
+from collections import OrderedDict
+from distutils.version import LooseVersion
+import json
+import os
+from subprocess import CalledProcessError, check_call, check_output
+import tempfile
+
+import yaml
+
+from charmhelpers.core.hookenv import cached, flush, local_unit
+
+
+@cached
+def _relation_settings(unit=None, rid=None):
+    args = ["relation-get", "--format=json"]
+    if rid:
+        args.extend(["-r", rid])
+    args.append("-")
+    if unit:
+        args.append(unit)
+    try:
+        return json.loads(check_output(args).decode("UTF-8"))
+    except ValueError:
+        return None
+    except CalledProcessError as e:
+        if e.returncode == 2:
+            return None
+        raise
+
+
+def relation_get(attribute=None, unit=None, rid=None):
+    """Same as charmhelpers.core.hookenv.relation_get but reads whole
+    relation data of the unit by one relation-get call per hook.
+    """
+    settings = _relation_settings(unit, rid)
+    if settings is None:
+        return None
+    if attribute is None:
+        return dict(settings)
+    return settings.get(attribute)
+
+
+@cached
+def _relation_set_accepts_file():
+    version = os.environ.get("JUJU_VERSION")
+    if version:
+        # --file was introduced in Juju 1.23.2
+        return LooseVersion(version) >= LooseVersion("1.23.2")
+    return "--file" in check_output(["relation-set", "--help"],
+                                    universal_newlines=True)
+
+
+def relation_set(relation_id=None, relation_settings=None, **kwargs):
+    """Same as charmhelpers.core.hookenv.relation_set but checks support
+    of --file once per process.
+    """
+    args = ["relation-set"]
+    if relation_id is not None:
+        args.extend(["-r", relation_id])
+    settings = dict(relation_settings or {})
+    settings.update(kwargs)
+    for key, value in settings.items():
+        if value is not None:
+            settings[key] = "{}".format(value)
+    if _relation_set_accepts_file():
+        # --file is used when possible as command line can be too long
+        with tempfile.NamedTemporaryFile(delete=False) as settings_file:
+            settings_file.write(yaml.safe_dump(settings).encode("utf-8"))
+        check_call(args + ["--file", settings_file.name])
+        os.remove(settings_file.name)
+    else:
+        for key, value in settings.items():
+            args.append("{}={}".format(key, "" if value is None else value))
+        check_call(args)
+    # relation data of the local unit has to be read again
+    flush(local_unit())
+
+
+def relation_set_many(settings_by_relation):
+    """Sets several relations of the current unit.
+
+    settings_by_relation is an iterable of (relation_id, settings) pairs.
+    Settings for the same relation id are merged, so each relation is
+    written once. It's still one relation-set call per relation id, as
+    relation-set can't write several relations at once.
+    """
+    merged = OrderedDict()
+    for relation_id, settings in settings_by_relation:
+        merged.setdefault(relation_id, dict()).update(settings)
+    for relation_id, settings in merged.items():
+        relation_set(relation_id=relation_id, relation_settings=settings)
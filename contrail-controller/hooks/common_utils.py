@@ -1,4 +1,5 @@
 from base64 import b64decode
+import hashlib
 import os
 from socket import gethostbyname, gethostname, gaierror
 from subprocess import (
@@ -9,22 +10,35 @@ from subprocess import (
 import netifaces
 import platform
 import json
+import tempfile
+import time
+import uuid
 
 from charmhelpers.contrib.network.ip import (
     get_address_in_network,
     get_iface_addr,
 )
+from charmhelpers.core import unitdata
 from charmhelpers.core.hookenv import (
+    atexit,
     config,
+    status_get,
     status_set,
     log,
     ERROR,
     application_version_set,
+    is_leader,
+    leader_get,
+    leader_set,
+    local_unit,
+    peer_relation_id,
+    related_units,
 )
 from charmhelpers.core.host import file_hash, write_file
-from charmhelpers.core.templating import render
 
 from docker_utils import (
+    get_container_state,
+    inspect_image,
     is_container_launched,
     is_container_present,
     apply_config_in_container,
@@ -32,10 +46,24 @@ from docker_utils import (
     launch_docker_image,
     get_contrail_version,
     docker_exec,
+    pull_docker_image,
+    remove_container,
+    tag_image,
 )
+from introspect_utils import probe_service, probe_services
+from relation_utils import relation_get, relation_set, relation_set_many
+from templating_utils import render
 
 config = config()
 
+CONFIG_DIR = "/etc/contrailctl"
+HOSTS_FILE = "/etc/hosts"
+SERVER_CERT = CONFIG_DIR + "/ssl/server.pem"
+SERVER_KEY = CONFIG_DIR + "/ssl/server-privkey.pem"
+CA_CERT = CONFIG_DIR + "/ssl/ca-cert.pem"
+
+_kv = None
+
 
 def get_ip():
     network = config.get("control-network")
@@ -71,7 +99,7 @@ def fix_hostname():
         ip = get_ip()
         check_call(["sed", "-E", "-i", "-e",
             ("/127.0.0.1[[:blank:]]+/a \\\n" + ip + " " + hostname),
-            "/etc/hosts"])
+            HOSTS_FILE])
 
 
 def decode_cert(key):
@@ -96,13 +124,12 @@ def save_file(path, data, perms=0o400):
         os.remove(path)
 
 
-def update_services_status(name, services):
+def _get_contrail_status(name):
     try:
         output = docker_exec(name, "contrail-status")
     except CalledProcessError as e:
         log("Container is not ready to get contrail-status: " + str(e))
-        status_set("waiting", "Waiting services to run in container")
-        return
+        return None
 
     statuses = dict()
     for line in output.splitlines()[1:]:
@@ -113,6 +140,31 @@ def update_services_status(name, services):
             continue
         srv = lst[0].split(":")[0]
         statuses[srv] = (lst[1], " ".join(lst[2:]))
+    return statuses
+
+
+def _introspect_certs():
+    if not config.get("ssl_enabled", False):
+        return None
+    return {"certfile": SERVER_CERT, "keyfile": SERVER_KEY, "cafile": CA_CERT}
+
+
+def is_service_active(service):
+    status = probe_service(service, get_ip(), _introspect_certs())
+    return status is not None and status[0] == "active"
+
+
+def update_services_status(name, services):
+    # introspect answers much faster than contrail-status that checks all
+    # services in container. contrail-status is used if introspect can't
+    # answer for some service.
+    statuses = probe_services(services, get_ip(), _introspect_certs())
+    if statuses is None:
+        statuses = _get_contrail_status(name)
+    if statuses is None:
+        status_set("waiting", "Waiting services to run in container")
+        return
+
     for srv in services:
         if srv not in statuses:
             status_set("waiting", srv + " is absent in the contrail-status")
@@ -127,14 +179,91 @@ def update_services_status(name, services):
     status_set("active", "Unit is ready")
 
 
+def _apply_states(rid):
+    """Returns {unit: (requested, done)} of configuration applies."""
+    states = dict()
+    for unit in related_units(rid) + [local_unit()]:
+        data = relation_get(unit=unit, rid=rid) or dict()
+        states[unit] = (data.get("apply-requested"), data.get("apply-done"))
+    return states
+
+
+def update_apply_slots():
+    """Grants slots to apply configuration to waiting peers.
+
+    It's run by the leader. No more than 'rolling-apply' units hold slots,
+    unit's slot is released when it reports that its services are active
+    after the apply.
+    """
+    limit = config.get("rolling-apply")
+    rid = peer_relation_id()
+    if not limit or not rid:
+        return
+    states = _apply_states(rid)
+    slots = json_loads(leader_get("apply-slots"), list())
+    granted = [unit for unit in slots
+               if unit in states and states[unit][0] != states[unit][1]]
+    for unit in sorted(states):
+        requested, done = states[unit]
+        if (len(granted) < limit and requested and requested != done
+                and unit not in granted):
+            granted.append(unit)
+    if granted != slots:
+        log("Units allowed to apply configuration: {}".format(granted))
+        leader_set({"apply-slots": json.dumps(granted)})
+
+
+def _has_apply_slot():
+    """Requests the slot to apply configuration if rolling apply is on.
+
+    Returns True if the unit can apply configuration now.
+    """
+    rid = peer_relation_id()
+    if not config.get("rolling-apply") or not rid:
+        return True
+    data = relation_get(unit=local_unit(), rid=rid) or dict()
+    requested = data.get("apply-requested")
+    if not requested or requested == data.get("apply-done"):
+        relation_set(relation_id=rid, relation_settings={
+            "apply-requested": uuid.uuid4().hex})
+        if is_leader():
+            update_apply_slots()
+    return local_unit() in json_loads(leader_get("apply-slots"), list())
+
+
+def _report_apply_done():
+    rid = peer_relation_id()
+    if not config.get("rolling-apply") or not rid:
+        return
+    data = relation_get(unit=local_unit(), rid=rid) or dict()
+    requested = data.get("apply-requested")
+    if (requested and requested != data.get("apply-done")
+            and status_get()[0] == "active"):
+        relation_set(relation_id=rid, relation_settings={
+            "apply-done": requested})
+        if is_leader():
+            update_apply_slots()
+
+
 def check_run_prerequisites(name, config_name, update_config_func, services):
+    if config.get("rolling-apply") and is_leader():
+        update_apply_slots()
     if is_container_launched(name):
         # already launched. just sync config if needed.
         check = True
         if update_config_func and update_config_func():
+            config["apply-pending"] = True
+        if config.get("apply-pending"):
+            # rendered configuration waits for the slot from the leader
+            if not _has_apply_slot():
+                status_set("waiting",
+                           "Waiting for a slot to apply configuration")
+                return False
             check = apply_config_in_container(name, config_name)
+            config.pop("apply-pending", None)
         if check:
             update_services_status(name, services)
+            _report_apply_done()
         return False
 
     if is_container_present(name):
@@ -185,55 +314,191 @@ def run_container(name, orchestrator):
     status_set("waiting", "Waiting services to run in container")
 
 
+def upgrade_container(name, launch_func):
+    """Replaces running container if the new image differs from its one.
+
+    New image is loaded from the resource (or pulled) and checked while
+    the old container still runs, so services are down only while
+    containers are swapped. launch_func must run the new container.
+    Returns True if container was swapped. If the new container doesn't
+    start, container with the old image is run again and exception is
+    raised.
+    """
+    state = get_container_state(name)
+    if not state.running:
+        return False
+
+    status_set("maintenance", "Loading new image")
+    image_name, image_tag = load_docker_image(name)
+    if not image_name or not image_tag:
+        image_name = config.get("image-name")
+        image_tag = config.get("image-tag")
+        if not image_name or not image_tag:
+            return False
+        pull_docker_image("{}:{}".format(image_name, image_tag))
+    image = "{}:{}".format(image_name, image_tag)
+    info = inspect_image(image)
+    if not info:
+        log("Image {} is absent, container is not upgraded".format(image),
+            level=ERROR)
+        return False
+    if info["Id"] == state.image:
+        log("Container {} already runs image {}".format(name, info["Id"]))
+        return False
+
+    old_name = config.get("image-name") or name
+    old_tag = config.get("image-tag") or "rollback"
+    config["image-name"] = image_name
+    config["image-tag"] = image_tag
+    started = time.time()
+    try:
+        # version is detected before the swap, it can run throwaway container
+        get_contrail_version()
+        status_set("maintenance", "Swapping container to new image")
+        remove_container(name)
+        launch_func()
+        launched = is_container_launched(name)
+    except Exception as e:
+        log("Container {} was not upgraded: {}".format(name, e), level=ERROR)
+        launched = False
+    if not launched:
+        _restore_container(name, state.image, old_name, old_tag, launch_func)
+        raise Exception("Container {} was not started with image {}, old "
+                        "image {}:{} is restored".format(
+                            name, image, old_name, old_tag))
+    log("Container {} was swapped to image {} in {:.1f} seconds".format(
+        name, info["Id"], time.time() - started))
+    return True
+
+
+def _restore_container(name, image_id, image_name, image_tag, launch_func):
+    """Runs container with the image it had before failed upgrade."""
+    config["image-name"] = image_name
+    config["image-tag"] = image_tag
+    state = get_container_state(name)
+    if state.running and state.image == image_id:
+        return
+    status_set("maintenance", "Restoring container with old image")
+    # new image could be loaded with the same name and tag
+    tag_image(image_id, "{}:{}".format(image_name, image_tag))
+    if state.present:
+        remove_container(name)
+    launch_func()
+    if not is_container_launched(name):
+        log("Container {} was not restored with image {}".format(
+            name, image_id), level=ERROR)
+
+
 def json_loads(data, default=None):
     return json.loads(data) if data else default
 
 
-def render_and_check(ctx, template, conf_file, do_check):
-    """Returns True if configuration has been changed."""
+def _parse_config(content):
+    sections = dict()
+    section = sections.setdefault("", dict())
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            section = sections.setdefault(line[1:-1], dict())
+            continue
+        key, _, value = line.partition("=")
+        section[key.strip()] = value.strip()
+    return sections
+
+
+def config_diff(old, new):
+    """Returns changes between two configs as {section: {key: (old, new)}}.
+
+    Comments and formatting are not taken into account.
+    """
+    old_cfg = _parse_config(old)
+    new_cfg = _parse_config(new)
+    diff = dict()
+    for name in set(old_cfg).union(new_cfg):
+        old_section = old_cfg.get(name, dict())
+        new_section = new_cfg.get(name, dict())
+        changes = dict()
+        for key in set(old_section).union(new_section):
+            old_value = old_section.get(key)
+            new_value = new_section.get(key)
+            if old_value != new_value:
+                changes[key] = (old_value, new_value)
+        if changes:
+            diff[name] = changes
+    return diff
+
+
+def _atomic_write(path, content, perms=0o444):
+    fdir = os.path.dirname(path)
+    if not os.path.exists(fdir):
+        os.makedirs(fdir, 0o755)
+    fd, tmp_path = tempfile.mkstemp(dir=fdir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            os.fchmod(f.fileno(), perms)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
 
-    log("Render and store new configuration: " + conf_file)
-    if do_check:
-        try:
-            with open(conf_file) as f:
-                old_lines = set(f.readlines())
-        except Exception:
-            old_lines = set()
 
-    ks_ca_path = "/etc/contrailctl/keystone-ca-cert.pem"
-    ks_ca_hash = file_hash(ks_ca_path) if do_check else None
+def render_and_check(ctx, template, conf_file):
+    """Renders configuration and stores it only if it has been changed.
+
+    Returns changes as {section: {key: (old, new)}}. Empty dict means that
+    configuration has not been changed.
+    """
+
+    ks_ca_path = os.path.join(CONFIG_DIR, "keystone-ca-cert.pem")
+    ks_ca_hash = file_hash(ks_ca_path)
     ks_ca = ctx.get("keystone_ssl_ca")
     save_file(ks_ca_path, ks_ca, 0o444)
     ks_ca_hash_new = file_hash(ks_ca_path)
     if ks_ca:
         ctx["keystone_ssl_ca_path"] = ks_ca_path
-    ca_changed = (ks_ca_hash != ks_ca_hash_new) if do_check else False
-    if ca_changed:
+
+    content = render(template, None, ctx).encode("UTF-8")
+    content_hash = hashlib.sha256(content).hexdigest()
+    hashes = json_loads(config.get("config-hashes"), dict())
+    diff = dict()
+    if hashes.get(conf_file) != content_hash or not os.path.exists(conf_file):
+        try:
+            with open(conf_file, "rb") as f:
+                old_content = f.read()
+        except IOError:
+            old_content = b""
+        if old_content != content:
+            log("Store new configuration: " + conf_file)
+            _atomic_write(conf_file, content)
+            diff = config_diff(old_content.decode("UTF-8"),
+                               content.decode("UTF-8"))
+        hashes[conf_file] = content_hash
+        config["config-hashes"] = json.dumps(hashes)
+
+    if ks_ca_hash != ks_ca_hash_new:
         log("Keystone CA cert has been changed: {h1} != {h2}"
             .format(h1=ks_ca_hash, h2=ks_ca_hash_new))
+        diff["keystone_ssl_ca"] = {"hash": (ks_ca_hash, ks_ca_hash_new)}
 
-    render(template, conf_file, ctx)
-    if not do_check:
-        return True
-    with open(conf_file) as f:
-        new_lines = set(f.readlines())
-    new_set = new_lines.difference(old_lines)
-    old_set = old_lines.difference(new_lines)
-    if new_set or old_set:
-        log("New lines:\n{new}".format(new="".join(new_set)))
-        log("Old lines:\n{old}".format(old="".join(old_set)))
+    if diff:
+        for section in sorted(diff):
+            for key, (old, new) in sorted(diff[section].items()):
+                log("Changed [{}] {}: {} => {}".format(section, key, old, new))
         log("Configuration file has been changed.")
     else:
         log("Configuration file has not been changed.")
-    return ca_changed or new_set or old_set
+    return diff
 
 
 def update_certificates(cert, key, ca):
     # NOTE: store files in default paths cause no way to pass this path to
     # some of components (sandesh)
-    files = {"/etc/contrailctl/ssl/server.pem": cert,
-             "/etc/contrailctl/ssl/server-privkey.pem": key,
-             "/etc/contrailctl/ssl/ca-cert.pem": ca}
+    files = {SERVER_CERT: cert,
+             SERVER_KEY: key,
+             CA_CERT: ca}
     changed = False
     for cfile in files:
         data = files[cfile]
@@ -242,3 +507,45 @@ def update_certificates(cert, key, ca):
         changed |= (old_hash != file_hash(cfile))
 
     return changed
+
+
+def unit_kv():
+    """Returns unit's key-value store that is flushed on successful exit."""
+    global _kv
+    if _kv is None:
+        _kv = unitdata.kv()
+        atexit(_kv.flush)
+    return _kv
+
+
+def relation_set_if_changed(settings_by_relation):
+    """Sets only the relation settings that differ from published ones.
+
+    `settings_by_relation` is an iterable of (relation_id, settings) pairs.
+    Values published last time are remembered per relation id in the unit's
+    key-value store. Relation with nothing changed is not written at all,
+    so remote units don't get useless relation-changed hooks.
+    """
+    kv = unit_kv()
+    writes = list()
+    for rid, settings in settings_by_relation:
+        key = "published-settings." + rid
+        published = kv.get(key, dict())
+        delta = dict()
+        for name, value in settings.items():
+            # relation data are always strings
+            value = "{}".format(value) if value is not None else None
+            if name not in published or published[name] != value:
+                delta[name] = value
+        suppressed = sorted(set(settings) - set(delta))
+        if not delta:
+            log("Relation {} is up to date, skip update of: {}"
+                .format(rid, ", ".join(suppressed)))
+            continue
+        if suppressed:
+            log("Relation {}: unchanged values are not sent: {}"
+                .format(rid, ", ".join(suppressed)))
+        writes.append((rid, delta))
+        published.update(delta)
+        kv.set(key, published)
+    relation_set_many(writes)
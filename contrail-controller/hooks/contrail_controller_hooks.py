@@ -15,9 +15,7 @@ from charmhelpers.core.hookenv import (
     is_leader,
     leader_get,
     leader_set,
-    relation_get,
     relation_ids,
-    relation_set,
     relation_id,
     related_units,
     status_set,
@@ -50,7 +48,11 @@ from common_utils import (
     get_ip,
     fix_hostname,
     json_loads,
+    relation_set_if_changed,
+    unit_kv,
+    update_apply_slots,
     update_certificates,
+    upgrade_container,
 )
 from docker_utils import (
     add_docker_repo,
@@ -59,9 +61,15 @@ from docker_utils import (
     DOCKER_PACKAGES,
     is_container_launched,
 )
+from hook_profiler import hook_profiling
+import reconciler
+from relation_utils import relation_get, relation_set, relation_set_many
 
 PACKAGES = []
 
+AGENTS_INFO_PREFIX = "agents-info."
+AGENT_DPDK_KEY = "agent-dpdk-"
+
 hooks = Hooks()
 config = config()
 
@@ -167,6 +175,8 @@ def _address_changed(unit, ip):
 def cluster_departed():
     if not is_leader():
         return
+    # slot of departed unit is released
+    update_apply_slots()
     unit = remote_unit()
     ips = json_loads(leader_get("controller_ips"), dict())
     if unit not in ips:
@@ -194,12 +204,11 @@ def config_changed():
         rnames = ("contrail-controller",
                   "contrail-analytics", "contrail-analyticsdb",
                   "http-services", "https-services")
-        for rname in rnames:
-            for rid in relation_ids(rname):
-                relation_set(relation_id=rid, relation_settings=settings)
-        settings = {"unit-address": ip}
-        for rid in relation_ids("controller-cluster"):
-            relation_set(relation_id=rid, relation_settings=settings)
+        writes = [(rid, settings) for rname in rnames
+                  for rid in relation_ids(rname)]
+        writes.extend((rid, {"unit-address": ip})
+                      for rid in relation_ids("controller-cluster"))
+        relation_set_many(writes)
         if is_leader():
             _address_changed(local_unit(), ip)
 
@@ -208,6 +217,7 @@ def config_changed():
     if config.changed("docker-user") or config.changed("docker-password"):
         docker_login()
 
+    reconciler.update_service()
     update_charm_status()
     _notify_proxy_services()
 
@@ -238,26 +248,68 @@ def update_northbound_relations(rid=None):
         settings["rabbitmq_hosts"] = None
 
     if rid:
-        relation_set(relation_id=rid, relation_settings=settings)
-        return
-
-    for rid in relation_ids("contrail-analytics"):
-        relation_set(relation_id=rid, relation_settings=settings)
-    for rid in relation_ids("contrail-analyticsdb"):
-        relation_set(relation_id=rid, relation_settings=settings)
+        rids = [rid]
+    else:
+        rids = (relation_ids("contrail-analytics")
+                + relation_ids("contrail-analyticsdb"))
+    relation_set_if_changed((rid, settings) for rid in rids)
 
 
-def update_southbound_relations(rid=None):
+def update_southbound_relations(rid=None, departed_agents=()):
     settings = {
         "api-vip": config.get("vip"),
         "analytics-server": json.dumps(get_analytics_list()),
         "auth-mode": config.get("auth-mode"),
         "auth-info": config.get("auth_info"),
         "orchestrator-info": config.get("orchestrator_info"),
-        "agents-info": config.get("agents-info")
+        # flags are published per agent now, drop the legacy blob
+        "agents-info": None,
     }
-    for rid in ([rid] if rid else relation_ids("contrail-controller")):
-        relation_set(relation_id=rid, relation_settings=settings)
+    # only orchestrator needs to know agents' flags
+    agents_settings = dict(
+        (AGENT_DPDK_KEY + address, dpdk)
+        for address, dpdk in get_agents_info().items())
+    agents_settings.update(
+        (AGENT_DPDK_KEY + address, None) for address in departed_agents)
+    rids = [rid] if rid else relation_ids("contrail-controller")
+    writes = list()
+    for rid in rids:
+        rid_settings = dict(settings)
+        if not _is_agents_relation(rid):
+            rid_settings.update(agents_settings)
+        writes.append((rid, rid_settings))
+    relation_set_if_changed(writes)
+
+
+def _is_agents_relation(rid):
+    for unit in related_units(rid):
+        if relation_get("unit-type", unit, rid) == "agent":
+            return True
+    return False
+
+
+def get_agents_info():
+    """Returns dpdk flags of agents keyed by agent's address."""
+    kv = unit_kv()
+    legacy = config.pop("agents-info", None)
+    if legacy:
+        # migrate flags stored by previous version of the charm
+        for address, dpdk in json_loads(legacy, dict()).items():
+            kv.set(AGENTS_INFO_PREFIX + address, dpdk)
+    return kv.getrange(AGENTS_INFO_PREFIX, strip=True)
+
+
+def set_agent_info(address, dpdk):
+    """Stores agent's dpdk flag. Returns True if it was changed."""
+    kv = unit_kv()
+    key = AGENTS_INFO_PREFIX + address
+    if kv.get(key) == dpdk:
+        return False
+    if dpdk is None:
+        kv.unset(key)
+    else:
+        kv.set(key, dpdk)
+    return True
 
 
 @hooks.hook("contrail-controller-relation-joined")
@@ -278,11 +330,7 @@ def contrail_controller_changed():
     if is_leader():
         if "dpdk" in data:
             # remote unit is an agent
-            address = data["private-address"]
-            flags = json_loads(config.get("agents-info"), dict())
-            flags[address] = data["dpdk"]
-            config["agents-info"] = json.dumps(flags)
-            config.save()
+            set_agent_info(data["private-address"], data["dpdk"])
         update_southbound_relations()
         update_northbound_relations()
     update_charm_status()
@@ -290,6 +338,12 @@ def contrail_controller_changed():
 
 @hooks.hook("contrail-controller-relation-departed")
 def contrail_controller_departed():
+    if is_leader():
+        data = relation_get()
+        address = data.get("private-address")
+        if "dpdk" in data and set_agent_info(address, None):
+            update_southbound_relations(departed_agents=[address])
+
     # while we have at least one openstack unit on the remote end
     # then we can suggest that orchestrator is still openstack
     for rid in relation_ids("contrail-controller"):
@@ -369,14 +423,16 @@ def update_status():
 
 @hooks.hook("upgrade-charm")
 def upgrade_charm():
-    # NOTE: old image can not be deleted if container is running.
-    # TODO: so think about killing the container
-
     # clear cached version of image
     config.pop("version_with_build", None)
     config.pop("version", None)
     config.save()
 
+    # new image is loaded while the old container is running, then
+    # containers are swapped
+    if upgrade_container(CONTAINER_NAME, update_charm_status):
+        return
+
     # NOTE: this hook can be fired when either resource changed or charm code
     # changed. so if code was changed then we may need to update config
     update_charm_status()
@@ -581,9 +637,15 @@ def _tls_changed(cert, key, ca):
     update_charm_status(force=True)
 
 
+@hooks.hook("stop")
+def stop():
+    reconciler.remove_service()
+
+
 def main():
     try:
-        hooks.execute(sys.argv)
+        with hook_profiling():
+            hooks.execute(sys.argv)
     except UnregisteredHookError as e:
         log("Unknown hook {} - skipping.".format(e))
 
@@ -1,6 +1,6 @@
+import json
 from socket import inet_aton, gethostname
 import struct
-import time
 
 import apt_pkg
 
@@ -8,7 +8,6 @@ from charmhelpers.core.hookenv import (
     config,
     related_units,
     relation_ids,
-    relation_get,
     status_set,
     status_get,
     leader_get,
@@ -18,15 +17,20 @@ from charmhelpers.core.hookenv import (
 )
 
 from common_utils import (
+    CONFIG_DIR,
     get_ip,
     check_run_prerequisites,
+    is_service_active,
     run_container,
     json_loads,
     render_and_check,
     update_services_status
 )
 
+import contrail_api_utils
 import docker_utils
+import reconciler
+from relation_utils import relation_get
 
 
 apt_pkg.init()
@@ -96,15 +100,31 @@ def get_context():
     return ctx
 
 
+def _container_cmd(cmd):
+    return [docker_utils.DOCKER_CLI, "exec", CONTAINER_NAME] + cmd
+
+
+def _provision_control_request(ip, bgp_asn, identity):
+    # register control node as a BGP speaker without md5
+    return {
+        "servers": [ip],
+        "identity": identity,
+        "insecure": bool(config.get("keystone-insecure")),
+        "calls": [
+            ["set_global_asn", [bgp_asn]],
+            ["add_bgp_router", [gethostname(), ip, bgp_asn]],
+        ],
+    }
+
+
 def update_charm_status(update_config=True, force=False):
 
-    def _render_config(ctx=None, do_check=True):
+    def _render_config(ctx=None):
         if not ctx:
             ctx = get_context()
         changed = render_and_check(
-            ctx, "controller.conf",
-            "/etc/contrailctl/controller.conf", do_check)
-        return (force or changed)
+            ctx, "controller.conf", CONFIG_DIR + "/controller.conf")
+        return (force or bool(changed))
 
     update_config_func = _render_config if update_config else None
     result = check_run_prerequisites(CONTAINER_NAME, CONFIG_NAME,
@@ -118,26 +138,21 @@ def update_charm_status(update_config=True, force=False):
         try:
             ip = get_ip()
             bgp_asn = '64512'
-            # register control node to config api server (no auth)
-            cmd = [
-                '/usr/share/contrail-utils/provision_control.py',
-                '--api_server_ip', ip, '--router_asn', bgp_asn,
-                '--admin_user', identity.get("keystone_admin_user"),
-                '--admin_password', identity.get("keystone_admin_password"),
-                '--admin_tenant_name', identity.get("keystone_admin_tenant")]
-            docker_utils.docker_exec(CONTAINER_NAME, cmd, shell=True)
-            # register control node as a BGP speaker without md5 (no auth)
-            cmd = [
-                '/usr/share/contrail-utils/provision_control.py',
-                '--api_server_ip', ip, '--router_asn', bgp_asn,
-                '--host_name', gethostname(), '--host_ip', ip, '--oper', 'add',
-                '--admin_user', identity.get("keystone_admin_user"),
-                '--admin_password', identity.get("keystone_admin_password"),
-                '--admin_tenant_name', identity.get("keystone_admin_tenant")]
-            docker_utils.docker_exec(CONTAINER_NAME, cmd, shell=True)
-            # wait a bit
-            time.sleep(8)
-            update_services_status(CONTAINER_NAME, SERVICES_TO_CHECK)
+            request = _provision_control_request(ip, bgp_asn, identity)
+            if reconciler.enabled():
+                # credentials are passed in a file readable only by root
+                path = reconciler.write_private(
+                    "provision-control", json.dumps(request, sort_keys=True))
+                reconciler.reconcile(
+                    "provision-control",
+                    [[contrail_api_utils.command(path)]])
+            else:
+                index, failed = contrail_api_utils.run_request(request)
+                if index is None:
+                    raise failed[0][1]
+                docker_utils.wait_until(
+                    lambda: is_service_active("contrail-control"), timeout=8)
+                update_services_status(CONTAINER_NAME, SERVICES_TO_CHECK)
         except Exception as e:
             log("Can't provision control: {}".format(e), level=ERROR)
     # hack for contrail-api that is started at inapropriate moment to keystone
@@ -145,10 +160,13 @@ def update_charm_status(update_config=True, force=False):
             and '(Generic Connection:Keystone[] connection down)' in message):
         try:
             cmd = ['systemctl', 'restart', 'contrail-api']
-            docker_utils.docker_exec(CONTAINER_NAME, cmd, shell=True)
-            # wait a bit
-            time.sleep(8)
-            update_services_status(CONTAINER_NAME, SERVICES_TO_CHECK)
+            if reconciler.enabled():
+                reconciler.reconcile("restart-api", [[_container_cmd(cmd)]])
+            else:
+                docker_utils.docker_exec(CONTAINER_NAME, cmd, shell=True)
+                docker_utils.wait_until(
+                    lambda: is_service_active("contrail-api"), timeout=8)
+                update_services_status(CONTAINER_NAME, SERVICES_TO_CHECK)
         except Exception as e:
             log("Can't restart contrail-api: {}".format(e), level=ERROR)
 
@@ -182,5 +200,5 @@ def update_charm_status(update_config=True, force=False):
         return
     # TODO: what should happens if relation departed?
 
-    _render_config(ctx, do_check=False)
+    _render_config(ctx)
     run_container(CONTAINER_NAME, ctx.get("cloud_orchestrator"))
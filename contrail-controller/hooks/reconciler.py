@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""Background reconciler of slow charm operations.
+
+Hooks hand tasks to the reconciler instead of running slow commands
+themselves. A task is a list of steps, each step is a list of alternative
+commands: the step is done when any of its commands succeeds. Tasks and
+their results are kept in the unit data store shared with the service.
+The service runs pending tasks, retrying failed steps until task's timeout,
+and then runs update-status hook via juju-run so the charm can apply
+results and update the unit's status.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    charm_dir,
+    config,
+    local_unit,
+    log,
+)
+from charmhelpers.core.host import (
+    service,
+    service_restart,
+    service_stop,
+)
+
+RECONCILER_DB = ".reconciler.db"
+SYSTEMD_DIR = "/etc/systemd/system"
+POLL_INTERVAL = 5
+
+SERVICE_TEMPLATE = """[Unit]
+Description=Reconciler of charm operations for {unit}
+After=network.target
+
+[Service]
+Environment=CHARM_DIR={charm_dir}
+Environment=JUJU_UNIT_NAME={unit}
+ExecStart=/usr/bin/env python {charm_dir}/hooks/reconciler.py
+Restart=always
+RestartSec=10
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+
+def _db(path=None):
+    path = path or os.path.join(charm_dir(), RECONCILER_DB)
+    # tasks and their output are readable only by root
+    if not os.path.exists(path):
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+    elif os.stat(path).st_mode & 0o077:
+        os.chmod(path, 0o600)
+    return unitdata.Storage(path)
+
+
+def _service_name(unit=None):
+    return "juju-reconciler-" + (unit or local_unit()).replace("/", "-")
+
+
+def enabled():
+    return bool(config().get("reconciler"))
+
+
+def update_service():
+    """Installs or removes the service according to 'reconciler' option."""
+    name = _service_name()
+    path = os.path.join(SYSTEMD_DIR, name + ".service")
+    if not enabled():
+        remove_service()
+        return
+
+    content = SERVICE_TEMPLATE.format(unit=local_unit(), charm_dir=charm_dir())
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                return
+    with open(path, "w") as f:
+        f.write(content)
+    subprocess.check_call(["systemctl", "daemon-reload"])
+    service("enable", name)
+    service_restart(name)
+
+
+def remove_service():
+    """Stops and removes the service, it's called by stop hook too.
+
+    Pending tasks (e.g. deprovisioning of the unit) are run by the hook
+    after the service is stopped, so they are not lost.
+    """
+    name = _service_name()
+    path = os.path.join(SYSTEMD_DIR, name + ".service")
+    if not os.path.exists(path):
+        return
+    service_stop(name)
+    if reconcile_once():
+        log("Pending reconciler tasks are run before its removal")
+    service("disable", name)
+    os.remove(path)
+    subprocess.check_call(["systemctl", "daemon-reload"])
+
+
+def reconcile(name, steps, timeout=60, delay=10):
+    """Hands the task to the reconciler.
+
+    Returns the result of the finished task (True or False) once, the next
+    call submits the task again. Returns None while the task is pending.
+    Task with other steps replaces the pending one.
+    """
+    digest = hashlib.sha256(
+        json.dumps(steps, sort_keys=True).encode("UTF-8")).hexdigest()
+    db = _db()
+    try:
+        task = db.get("task." + name)
+        result = db.get("result." + name)
+        if task and task["digest"] == digest:
+            if not result or result["generation"] != task["generation"]:
+                return None
+            if not result.get("consumed"):
+                result["consumed"] = True
+                db.set("result." + name, result)
+                db.flush()
+                log("Reconciler task {} finished: {}".format(
+                    name, "success" if result["ok"] else result["output"]))
+                return result["ok"]
+        generation = (task["generation"] + 1) if task else 1
+        db.set("task." + name, {
+            "generation": generation,
+            "digest": digest,
+            "steps": steps,
+            "timeout": timeout,
+            "delay": delay,
+        })
+        db.flush()
+        log("Reconciler task {} is submitted".format(name))
+        return None
+    finally:
+        db.close()
+
+
+def write_private(name, data):
+    """Writes data to a file readable only by root and returns its path.
+
+    It's for credentials that must not be in commands of steps. File name
+    has digest of data, so the steps that refer to it change with the data.
+    Previous files of the name are removed.
+    """
+    digest = hashlib.sha256(data.encode("UTF-8")).hexdigest()[:16]
+    prefix = ".request-{}-".format(name)
+    fname = prefix + digest
+    for old in os.listdir(charm_dir()):
+        # result of the request is kept with it
+        if old.startswith(prefix) and not old.startswith(fname):
+            os.remove(os.path.join(charm_dir(), old))
+    path = os.path.join(charm_dir(), fname)
+    if not os.path.exists(path):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+    return path
+
+
+def _redact(cmd, output):
+    """Hides values of password arguments in the command and its output."""
+    args = ["{}".format(arg) for arg in cmd]
+    secrets = list()
+    for index, arg in enumerate(args):
+        name, sep, value = arg.partition("=")
+        if "password" not in name.lower():
+            continue
+        if sep:
+            secrets.append(value)
+            args[index] = name + "=***"
+        elif index + 1 < len(args):
+            secrets.append(args[index + 1])
+            args[index + 1] = "***"
+    output = "{}".format(output)
+    for secret in secrets:
+        if secret:
+            output = output.replace(secret, "***")
+    return " ".join(args), output
+
+
+def _run_step(commands):
+    output = ""
+    for cmd in commands:
+        try:
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+            return True, ""
+        except Exception as e:
+            output = "{}: {}".format(
+                *_redact(cmd, getattr(e, "output", None) or e))
+    return False, output
+
+
+def run_task(task):
+    deadline = time.time() + task["timeout"]
+    for commands in task["steps"]:
+        while True:
+            ok, output = _run_step(commands)
+            if ok:
+                break
+            if time.time() >= deadline:
+                return False, output
+            time.sleep(task["delay"])
+    return True, ""
+
+
+def reconcile_once(path=None):
+    """Runs all pending tasks. Returns True if any task was run."""
+    db = _db(path)
+    try:
+        tasks = db.getrange("task.", strip=True)
+        results = db.getrange("result.", strip=True)
+    finally:
+        db.close()
+
+    ran = False
+    for name, task in sorted(tasks.items()):
+        result = results.get(name)
+        if result and result["generation"] == task["generation"]:
+            continue
+        ok, output = run_task(task)
+        ran = True
+        db = _db(path)
+        try:
+            db.set("result." + name, {
+                "generation": task["generation"],
+                "ok": ok,
+                "output": output[-2000:],
+                "finished": time.time(),
+            })
+            db.flush()
+        finally:
+            db.close()
+        sys.stdout.write("Task {} generation {} finished: {}\n".format(
+            name, task["generation"], "success" if ok else output))
+        sys.stdout.flush()
+    return ran
+
+
+def main():
+    unit = os.environ["JUJU_UNIT_NAME"]
+    path = os.path.join(os.environ["CHARM_DIR"], RECONCILER_DB)
+    while True:
+        try:
+            if reconcile_once(path):
+                # let the charm apply results and update status
+                subprocess.call(["juju-run", unit, "hooks/update-status"])
+        except Exception as e:
+            sys.stdout.write("Reconcile failed: {}\n".format(e))
+            sys.stdout.flush()
+        time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
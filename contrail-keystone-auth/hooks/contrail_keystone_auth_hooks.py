@@ -10,14 +10,14 @@ from charmhelpers.core.hookenv import (
     config,
     log,
     is_leader,
-    relation_get,
     relation_ids,
-    relation_set,
     relation_id,
     related_units,
     status_set,
     ERROR,
 )
+from hook_profiler import hook_profiling
+from relation_utils import relation_get, relation_set_many
 
 hooks = Hooks()
 config = config()
@@ -44,8 +44,8 @@ def update_relations(rid=None):
     settings = {
         "auth-info": auth_info
     }
-    for rid in ([rid] if rid else relation_ids("contrail-auth")):
-        relation_set(relation_id=rid, relation_settings=settings)
+    rids = [rid] if rid else relation_ids("contrail-auth")
+    relation_set_many((rid, settings) for rid in rids)
 
 
 @hooks.hook("config-changed")
@@ -123,7 +123,8 @@ def update_status():
 
 def main():
     try:
-        hooks.execute(sys.argv)
+        with hook_profiling():
+            hooks.execute(sys.argv)
     except UnregisteredHookError as e:
         log("Unknown hook {} - skipping.".format(e))
 
@@ -13,9 +13,7 @@ from charmhelpers.core.hookenv import (
     config,
     log,
     related_units,
-    relation_get,
     relation_ids,
-    relation_set,
     status_set,
     leader_get,
     leader_set,
@@ -40,6 +38,8 @@ from contrail_openstack_utils import (
     update_service_ips,
     get_context
 )
+from hook_profiler import hook_profiling
+from relation_utils import relation_get, relation_set
 
 NEUTRON_API_PACKAGES = ["neutron-plugin-contrail"]
 
@@ -105,13 +105,15 @@ def contrail_controller_changed():
     _update_config("api_port", "port")
     _update_config("auth_mode", "auth-mode")
 
-    info = data.get("agents-info")
-    if not info:
+    ip = unit_private_ip()
+    value = data.get("agent-dpdk-" + ip)
+    if value is None and data.get("agents-info"):
+        # controller of previous version publishes flags of all agents
+        value = json.loads(data["agents-info"]).get(ip)
+    if value is None:
         config["dpdk"] = False
-        log("DPDK for current host is False. agents-info is not provided.")
+        log("DPDK for current host is False. It is not provided.")
     else:
-        ip = unit_private_ip()
-        value = json.loads(info).get(ip, False)
         if not isinstance(value, bool):
             value = yaml.load(value)
         config["dpdk"] = value
@@ -348,7 +350,8 @@ def update_status():
 
 def main():
     try:
-        hooks.execute(sys.argv)
+        with hook_profiling():
+            hooks.execute(sys.argv)
     except UnregisteredHookError as e:
         log("Unknown hook {} - skipping.".format(e))
 
@@ -1,29 +1,39 @@
 import apt_pkg
+from datetime import datetime
+import hashlib
 import json
 import os
 import requests
 from six.moves.urllib.parse import urlparse
 from socket import gethostbyname
+import threading
+import time
 
 from charmhelpers.core.hookenv import (
     config,
     log,
     WARNING,
     relation_ids,
-    relation_get,
     related_units,
     leader_get,
     leader_set,
 )
-from charmhelpers.core.host import (
-    restart_on_change,
-    write_file,
-)
-from charmhelpers.core.templating import render
+from charmhelpers.core.host import write_file
+
+from relation_utils import relation_get
+from restart_utils import restart_on_change
+from templating_utils import render
 
 apt_pkg.init()
 config = config()
 
+# catalog is requested again if token expires earlier than this
+TOKEN_EXPIRY_MARGIN = 300
+DNS_CACHE_TTL = 300
+
+# connections to Keystone are pooled for the hook
+_session = requests.Session()
+
 
 def update_service_ips():
     try:
@@ -59,6 +69,31 @@ def _get_endpoints():
     if not auth_info or not auth_info.get("keystone_ip"):
         raise Exception("auth_info is not ready.")
 
+    catalog = _get_catalog(auth_info)
+    hosts = _resolve_hosts(
+        set(urlparse(url).hostname for url in catalog.values()))
+    result = dict()
+    for service_type, url in catalog.items():
+        result[service_type + "_service_ip"] = hosts[urlparse(url).hostname]
+    return result
+
+
+def _get_catalog(auth_info):
+    """Returns {service type: url} from Keystone catalog.
+
+    Catalog is cached in unit state until the token it was issued with
+    expires, so Keystone doesn't authenticate the password on every
+    update-status. Changed auth_info or endpoint type invalidates it.
+    """
+    interface = ("internal" if config.get("use-internal-endpoints", False)
+                 else "public")
+    key = hashlib.sha256(json.dumps(
+        [auth_info, interface], sort_keys=True).encode("UTF-8")).hexdigest()
+    cache = json.loads(config.get("keystone-catalog") or "{}")
+    if (cache.get("key") == key
+            and cache.get("expires", 0) - TOKEN_EXPIRY_MARGIN > time.time()):
+        return cache["catalog"]
+
     api_ver = int(auth_info["keystone_api_version"])
     if api_ver == 2:
         req_data = {
@@ -92,34 +127,74 @@ def _get_endpoints():
             }
         }
 
-    endpoint_v2 = "publicURL"
-    endpoint_v3 = "public"
-    if config.get("use-internal-endpoints", False):
-        endpoint_v2 = "internalURL"
-        endpoint_v3 = "internal"
-
     url = "{proto}://{ip}:{port}/{tokens}".format(
         proto=auth_info["keystone_protocol"],
         ip=auth_info["keystone_ip"],
         port=auth_info["keystone_public_port"],
         tokens=auth_info["keystone_api_tokens"])
-    r = requests.post(url, headers={'Content-type': 'application/json'},
+    r = _session.post(url, headers={'Content-type': 'application/json'},
                       data=json.dumps(req_data), verify=False)
     content = json.loads(r.content)
-    result = dict()
-    catalog = (content["access"]["serviceCatalog"] if api_ver == 2 else
-               content["token"]["catalog"])
-    for service in catalog:
+    catalog = dict()
+    if api_ver == 2:
+        services = content["access"]["serviceCatalog"]
+        expires = content["access"]["token"]["expires"]
+    else:
+        services = content["token"]["catalog"]
+        expires = content["token"]["expires_at"]
+    for service in services:
         if api_ver == 2:
             # NOTE: 0 means first region. do we need to search for region?
-            url = service["endpoints"][0][endpoint_v2]
+            url = service["endpoints"][0][interface + "URL"]
         else:
             for endpoint in service["endpoints"]:
-                if endpoint["interface"] == endpoint_v3:
+                if endpoint["interface"] == interface:
                     url = endpoint["url"]
                     break
-        host = gethostbyname(urlparse(url).hostname)
-        result[service["type"] + "_service_ip"] = host
+        catalog[service["type"]] = url
+
+    config["keystone-catalog"] = json.dumps({
+        "key": key,
+        "expires": _parse_expiry(expires),
+        "catalog": catalog,
+    })
+    return catalog
+
+
+def _parse_expiry(value):
+    # Keystone returns UTC time like 2017-12-01T10:00:00[.000000]Z
+    expires = datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+    return (expires - datetime(1970, 1, 1)).total_seconds()
+
+
+def _resolve_hosts(hosts):
+    """Resolves host names concurrently, results are cached for a while."""
+    cache = json.loads(config.get("dns-cache") or "{}")
+    now = time.time()
+    result = dict((host, cache[host][0]) for host in hosts
+                  if host in cache and now - cache[host][1] < DNS_CACHE_TTL)
+    errors = list()
+
+    def _resolve(host):
+        try:
+            result[host] = gethostbyname(host)
+        except Exception as e:
+            errors.append(e)
+
+    unresolved = [host for host in hosts if host not in result]
+    threads = [threading.Thread(target=_resolve, args=(host,))
+               for host in unresolved]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    for host in unresolved:
+        cache[host] = [result[host], now]
+    config["dns-cache"] = json.dumps(dict(
+        (host, value) for host, value in cache.items()
+        if now - value[1] < DNS_CACHE_TTL))
     return result
 
 
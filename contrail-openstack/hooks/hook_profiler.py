@@ -0,0 +1,214 @@
+"""Opt-in profiler of hook execution.
+
+When 'hook-profiling' option is set then wall time of the hook, every
+subprocess it runs (hook tools, docker, apt, contrail-status, ...), calls of
+docker API, template rendering and sleeps are recorded into the rolling table
+of unit's data. 'hook-profile' action shows recorded profiles.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    action_get,
+    action_set,
+    charm_dir,
+    config,
+    hook_name,
+    log,
+)
+
+import templating_utils
+
+PROFILES_DB = ".hook-profiles.db"
+PROFILES_KEY = "hook-profiles"
+PROFILES_DEPTH = 50
+SLOWEST_CALLS = 20
+
+_profile = None
+
+
+class HookProfile(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.totals = dict()
+        self.calls = list()
+
+    def add(self, kind, name, duration, call=None):
+        count, total = self.totals.setdefault(kind, dict()).get(name, (0, 0))
+        self.totals[kind][name] = (count + 1, total + duration)
+        if call:
+            self.calls.append((duration, call))
+
+    def result(self, failed):
+        totals = dict()
+        for kind, names in self.totals.items():
+            totals[kind] = dict(
+                (name, {"count": count, "time": round(total, 3)})
+                for name, (count, total) in names.items())
+        slowest = sorted(self.calls, reverse=True)[:SLOWEST_CALLS]
+        return {
+            "hook": self.name,
+            "started": datetime.utcfromtimestamp(self.started).isoformat(),
+            "duration": round(time.time() - self.started, 3),
+            "failed": failed,
+            "totals": totals,
+            "slowest-calls": [{"time": round(duration, 3), "call": call}
+                              for duration, call in slowest],
+        }
+
+
+def _record(kind, name, started, call=None):
+    if _profile is not None:
+        _profile.add(kind, name, time.time() - started, call)
+
+
+def _command(args):
+    if isinstance(args, (list, tuple)):
+        args = " ".join("{}".format(arg) for arg in args)
+    args = "{}".format(args)
+    name = os.path.basename(args.split(" ", 1)[0])
+    return name, args[:200]
+
+
+_Popen = subprocess.Popen
+
+
+class _ProfiledPopen(_Popen):
+
+    def __init__(self, *args, **kwargs):
+        self._profile_started = time.time()
+        self._profile_command = _command(
+            args[0] if args else kwargs.get("args"))
+        super(_ProfiledPopen, self).__init__(*args, **kwargs)
+
+    def _profile_finished(self, running):
+        if running and self.returncode is not None:
+            name, call = self._profile_command
+            _record("subprocess", name, self._profile_started, call)
+
+    def wait(self, *args, **kwargs):
+        running = self.returncode is None
+        try:
+            return super(_ProfiledPopen, self).wait(*args, **kwargs)
+        finally:
+            self._profile_finished(running)
+
+    def poll(self, *args, **kwargs):
+        running = self.returncode is None
+        try:
+            return super(_ProfiledPopen, self).poll(*args, **kwargs)
+        finally:
+            self._profile_finished(running)
+
+
+def _timed(kind, func, name_of):
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(kind, name_of(*args, **kwargs), started)
+    wrapper._wrapped = func
+    return wrapper
+
+
+def _docker_request_name(client, method, url, *args, **kwargs):
+    return "{} {}".format(method, url.split("?", 1)[0])
+
+
+def _patches():
+    patches = [
+        (_Popen, _ProfiledPopen),
+        (templating_utils.render, _timed(
+            "render", templating_utils.render,
+            lambda source, *a, **kw: source)),
+        (time.sleep, _timed("sleep", time.sleep, lambda *a, **kw: "sleep")),
+    ]
+    docker_utils = sys.modules.get("docker_utils")
+    client = getattr(docker_utils, "DockerClient", None)
+    request = vars(client).get("_request") if client else None
+    if request is not None:
+        patches.append((request, _timed(
+            "docker-api", request, _docker_request_name)))
+    return patches
+
+
+def _replace(patches):
+    # functions are usually imported by name, so references in all loaded
+    # modules and classes defined there have to be replaced
+    for module in list(sys.modules.values()):
+        if module is None or module is sys.modules[__name__]:
+            continue
+        namespaces = [module]
+        namespaces.extend(v for v in vars(module).values()
+                          if isinstance(v, type)
+                          and v.__module__ == module.__name__)
+        for namespace in namespaces:
+            for name, value in list(vars(namespace).items()):
+                for original, replacement in patches:
+                    if value is original:
+                        setattr(namespace, name, replacement)
+
+
+def _save(profile):
+    db = unitdata.Storage(os.path.join(charm_dir(), PROFILES_DB))
+    try:
+        profiles = db.get(PROFILES_KEY, list())
+        profiles.append(profile)
+        db.set(PROFILES_KEY, profiles[-PROFILES_DEPTH:])
+        db.flush()
+    finally:
+        db.close()
+
+
+@contextmanager
+def hook_profiling():
+    """Profiles the hook executed inside if 'hook-profiling' is enabled."""
+    global _profile
+    if not config().get("hook-profiling"):
+        yield
+        return
+
+    _profile = HookProfile(hook_name())
+    patches = _patches()
+    _replace(patches)
+    failed = True
+    try:
+        yield
+        failed = False
+    except SystemExit as e:
+        failed = e.code not in (None, 0)
+        raise
+    finally:
+        _replace([(new, old) for old, new in patches])
+        profile = _profile.result(failed)
+        _profile = None
+        try:
+            _save(profile)
+        except Exception as e:
+            log("Hook profile was not saved: {}".format(e))
+
+
+def show_profiles():
+    """Sets recorded hook profiles as a result of the action."""
+    db = unitdata.Storage(os.path.join(charm_dir(), PROFILES_DB))
+    try:
+        profiles = db.get(PROFILES_KEY, list())
+    finally:
+        db.close()
+    hook = action_get("hook")
+    if hook:
+        profiles = [p for p in profiles if p["hook"] == hook]
+    count = action_get("count")
+    if count:
+        profiles = profiles[-int(count):]
+    action_set({"profiles": json.dumps(profiles, sort_keys=True)})
@@ -0,0 +1,152 @@
+"""Coalesced service restarts.
+
+Restart requests made during a hook are collected and each service is
+restarted once when the hook finishes successfully. Requests are saved in
+the unit's restart store at once, so restarts requested by a failed hook
+are run by the next one. With 'restart-min-interval' option the service
+isn't restarted more often than that: restart is postponed to one of the
+next hooks.
+"""
+
+import functools
+import os
+from time import time
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    atexit,
+    atstart,
+    charm_dir,
+    config,
+    log,
+)
+from charmhelpers.core.host import (
+    path_hash,
+    service_restart,
+)
+
+RESTARTS_DB = ".restarts.db"
+
+_registered = list()
+
+
+def _update(func):
+    """Calls func with saved pending restarts and restart times.
+
+    Changes made by func are saved at once, not at the end of the hook.
+    """
+    db = unitdata.Storage(os.path.join(charm_dir(), RESTARTS_DB))
+    try:
+        pending = db.get("pending", list())
+        times = db.get("times", dict())
+        result = func(pending, times)
+        db.set("pending", pending)
+        db.set("times", times)
+        db.flush()
+        return result
+    finally:
+        db.close()
+
+
+def _register():
+    if not _registered:
+        atexit(run_restarts)
+        _registered.append(True)
+
+
+def _load_pending():
+    # restarts left by failed hooks or postponed ones are run by this hook
+    if _update(lambda pending, times: bool(pending)):
+        _register()
+
+
+atstart(_load_pending)
+
+
+def schedule_restart(service):
+    """Requests restart of the service at the end of the hook."""
+    def _add(pending, times):
+        if service in pending:
+            return False
+        pending.append(service)
+        return True
+
+    if _update(_add):
+        log("Restart of {} is scheduled".format(service))
+    _register()
+
+
+def restart_service(service):
+    """Restarts the service now, its scheduled restart is dropped."""
+    service_restart(service)
+
+    def _done(pending, times):
+        if service in pending:
+            pending.remove(service)
+        times[service] = time()
+
+    _update(_done)
+
+
+def restart_on_change(restart_map):
+    """Schedules restarts of services whose files are changed.
+
+    Unlike restart_on_change of charmhelpers, restarts of all services of
+    the map are saved before the decorated function is called, so they are
+    not lost if it fails after some files are written. Restarts of services
+    whose files are not changed are dropped after the call.
+    """
+    services = list()
+    for path in restart_map:
+        services.extend(srv for srv in restart_map[path]
+                        if srv not in services)
+
+    def wrap(f):
+        @functools.wraps(f)
+        def wrapped_f(*args, **kwargs):
+            checksums = dict((path, path_hash(path)) for path in restart_map)
+
+            def _add(pending, times):
+                added = [srv for srv in services if srv not in pending]
+                pending.extend(added)
+                return added
+
+            added = _update(_add)
+            result = f(*args, **kwargs)
+            changed = list()
+            for path in restart_map:
+                if path_hash(path) != checksums[path]:
+                    changed.extend(srv for srv in restart_map[path]
+                                   if srv not in changed)
+
+            def _drop(pending, times):
+                for srv in added:
+                    if srv not in changed and srv in pending:
+                        pending.remove(srv)
+
+            _update(_drop)
+            for srv in changed:
+                log("Restart of {} is scheduled".format(srv))
+            if changed:
+                _register()
+            return result
+        return wrapped_f
+    return wrap
+
+
+def run_restarts():
+    """Runs saved restarts.
+
+    Restart is postponed if the service was restarted less than
+    'restart-min-interval' seconds ago.
+    """
+    del _registered[:]
+    interval = config().get("restart-min-interval") or 0
+    pending, times = _update(
+        lambda pending, times: (list(pending), dict(times)))
+    now = time()
+    for service in pending:
+        if now - times.get(service, 0) < interval:
+            log("Restart of {} is postponed".format(service))
+            continue
+        restart_service(service)
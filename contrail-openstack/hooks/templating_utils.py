@@ -0,0 +1,85 @@
+"""Rendering of templates with cached jinja2 environments.
+
+charmhelpers.core.templating.render builds new jinja2 environment and
+compiles the template on every call. Here environments are kept for the
+whole process and compiled templates are kept in the charm dir, because
+each hook is a new process. charmhelpers is synced from upstream, so the
+cache lives in the charm.
+"""
+
+import os
+import sys
+
+from charmhelpers.core import host
+from charmhelpers.core.hookenv import (
+    charm_dir,
+    log,
+    ERROR,
+    WARNING,
+)
+
+# directory inside the charm for compiled templates
+BYTECODE_CACHE_DIR = ".jinja2-bytecode-cache"
+
+# jinja2 environments by templates dir (or loader)
+_template_envs = dict()
+
+
+def _bytecode_cache():
+    from jinja2 import FileSystemBytecodeCache
+    if not charm_dir():
+        return None
+    cache_dir = os.path.join(charm_dir(), BYTECODE_CACHE_DIR)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+    except OSError as e:
+        log("Could not create bytecode cache dir {}: {}"
+            .format(cache_dir, e), level=WARNING)
+        return None
+    # cached bytecode is checked against checksum of template source
+    # so changed templates are recompiled
+    return FileSystemBytecodeCache(cache_dir)
+
+
+def _template_env(templates_dir, template_loader=None):
+    from jinja2 import Environment, FileSystemLoader
+    key = template_loader or templates_dir
+    env = _template_envs.get(key)
+    if env is None:
+        loader = template_loader or FileSystemLoader(templates_dir)
+        env = Environment(loader=loader, bytecode_cache=_bytecode_cache())
+        _template_envs[key] = env
+    return env
+
+
+def render(source, target, context, owner="root", group="root",
+           perms=0o444, templates_dir=None, encoding="UTF-8",
+           template_loader=None):
+    """Same as charmhelpers.core.templating.render but with caches."""
+    try:
+        from jinja2 import exceptions
+    except ImportError:
+        from charmhelpers.fetch import apt_install
+        if sys.version_info.major == 2:
+            apt_install("python-jinja2", fatal=True)
+        else:
+            apt_install("python3-jinja2", fatal=True)
+        from jinja2 import exceptions
+
+    if not template_loader and templates_dir is None:
+        templates_dir = os.path.join(charm_dir(), "templates")
+    env = _template_env(templates_dir, template_loader)
+    try:
+        template = env.get_template(source)
+    except exceptions.TemplateNotFound:
+        log("Could not load template {} from {}."
+            .format(source, templates_dir), level=ERROR)
+        raise
+    content = template.render(context)
+    if target is not None:
+        target_dir = os.path.dirname(target)
+        if not os.path.exists(target_dir):
+            host.mkdir(target_dir, owner, group, perms=0o755)
+        host.write_file(target, content.encode(encoding), owner, group, perms)
+    return content